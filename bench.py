@@ -0,0 +1,229 @@
+"""Reproducible benchmarks for the inference engine primitives.
+
+Runs util.match, instantiate, Bindings.test_and_bind, KnowledgeBase.kb_ask,
+kb_add and init_kb over a range of grid sizes and reports ops/sec, latency
+percentiles and peak memory. Results can be saved as a baseline and later runs
+compared against it, exiting non-zero on a regression.
+
+    python bench.py --save-baseline
+    python bench.py --sizes 5 10 --ops match kb_ask
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import minesweeper as ms
+from logical_classes import Bindings, Fact, Statement, Term
+from util import instantiate, match
+
+SIZES = (5, 10, 20, 30)
+BASELINE = 'bench_baseline.json'
+SEED = 1234
+
+def played_kb(gridsize, seed=SEED):
+    """KB and board after the opening move of a seeded game, with a non-empty
+        frontier to ask about
+    """
+    rng = random.Random(seed)
+    kb = ms.init_kb(gridsize, None)
+    currgrid = [[' ' for i in range(gridsize)] for i in range(gridsize)]
+    start = (gridsize // 2, gridsize // 2)
+    grid, mines = ms.setupgrid(gridsize, start, max(1, gridsize * gridsize // 8), rng)
+    ms.showcells(grid, currgrid, *start)
+    ms.updateKB(currgrid, kb)
+    return kb, currgrid
+
+def _cycle(items):
+    items = list(items)
+    state = {'i': 0}
+    def take():
+        item = items[state['i'] % len(items)]
+        state['i'] += 1
+        return item
+    return take
+
+def op_match(gridsize):
+    kb, grid = played_kb(gridsize)
+    pattern = Statement(['nextTo', '?t', ms.cellid(gridsize // 2, gridsize // 2)])
+    facts = _cycle(f.statement for f in kb.facts if f.statement.predicate == 'nextTo')
+    return lambda: match(pattern, facts())
+
+def op_instantiate(gridsize):
+    kb, grid = played_kb(gridsize)
+    rule = next(iter(kb.rules))
+    cells = [Term(ms.cellid(i, j)) for i in range(gridsize) for j in range(gridsize)]
+    all_bindings = []
+    for n, cell in enumerate(cells):
+        b = Bindings()
+        b.add_binding(Term('?t').term, cell.term)
+        b.add_binding(Term('?c').term, cells[(n + 1) % len(cells)].term)
+        all_bindings.append(b)
+    bindings = _cycle(all_bindings)
+    def run():
+        b = bindings()
+        for stmt in rule.lhs: instantiate(stmt, b)
+        instantiate(rule.rhs, b)
+    return run
+
+def op_test_and_bind(gridsize):
+    var = Term('?c')
+    cells = _cycle(Term(ms.cellid(i, j)) for i in range(gridsize) for j in range(gridsize))
+    def run():
+        b = Bindings()
+        value = cells()
+        b.test_and_bind(var, value)
+        b.test_and_bind(var, value)
+    return run
+
+def op_kb_ask(gridsize):
+    kb, grid = played_kb(gridsize)
+    goals = [Fact(Statement([pred, ms.cellid(*cell)]))
+             for cell in sorted(ms.findFrontier(grid)) for pred in ('bomb', 'safe')]
+    goals = _cycle(goals)
+    def run():
+        kb.clear_table()
+        kb.kb_ask(goals())
+    return run
+
+def op_kb_add(gridsize):
+    kb, grid = played_kb(gridsize)
+    counter = iter(range(10 ** 9))
+    return lambda: kb.kb_add(Fact(Statement(['probe', 'p{}'.format(next(counter))])))
+
+def op_init_kb(gridsize):
+    return lambda: ms.init_kb(gridsize, None)
+
+# name -> (operation factory, iterations per size)
+OPS = {
+    'match': (op_match, 20000),
+    'instantiate': (op_instantiate, 5000),
+    'test_and_bind': (op_test_and_bind, 20000),
+    'kb_ask': (op_kb_ask, 500),
+    'kb_add': (op_kb_add, 5000),
+    'init_kb': (op_init_kb, 5),
+}
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list
+    """
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def run_case(name, gridsize, iterations, rounds=3):
+    """Time iterations calls of one operation in each of several rounds and keep
+        the fastest round, then measure peak memory of a separate run under
+        tracemalloc so tracing does not skew the timings
+
+    Returns:
+        dict: ops_per_sec, p50_us, p95_us, p99_us and peak_kib
+    """
+    factory = OPS[name][0]
+    random.seed(SEED)
+    op = factory(gridsize)
+    for _ in range(min(iterations, 10)): op()
+    latencies = None
+    for _ in range(rounds):
+        round_latencies = []
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(iterations):
+                start = time.perf_counter_ns()
+                op()
+                round_latencies.append(time.perf_counter_ns() - start)
+        finally:
+            gc.enable()
+        if latencies is None or sum(round_latencies) < sum(latencies):
+            latencies = round_latencies
+    latencies.sort()
+
+    tracemalloc.start()
+    op = factory(gridsize)
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(min(iterations, 200)): op()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    total = sum(latencies) / 1e9
+    return {'ops_per_sec': round(iterations / total, 1) if total else float('inf'),
+            'p50_us': round(percentile(latencies, 50) / 1e3, 2),
+            'p95_us': round(percentile(latencies, 95) / 1e3, 2),
+            'p99_us': round(percentile(latencies, 99) / 1e3, 2),
+            'peak_kib': round(peak / 1024, 1)}
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline
+
+    Returns:
+        listof str: one message per case that is slower, or uses more peak
+            memory, than the baseline by more than tolerance
+    """
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get(key)
+        if not old: continue
+        if result['ops_per_sec'] < old['ops_per_sec'] * (1 - tolerance):
+            regressions.append('{}: {:.0f} ops/sec, baseline {:.0f}'.format(
+                    key, result['ops_per_sec'], old['ops_per_sec']))
+        if result['peak_kib'] > old['peak_kib'] * (1 + tolerance) + 64:
+            regressions.append('{}: peak {:.0f} KiB, baseline {:.0f} KiB'.format(
+                    key, result['peak_kib'], old['peak_kib']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--ops', nargs='+', choices=sorted(OPS), default=list(OPS))
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply the iteration counts, e.g. 0.1 for a quick run')
+    parser.add_argument('--rounds', type=int, default=3,
+                        help='timing rounds per case, the fastest one is reported')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional slowdown or memory growth')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    ms.verbose = 0
+    results = {}
+    print('{:<24} {:>12} {:>10} {:>10} {:>10} {:>10}'.format(
+            'case', 'ops/sec', 'p50 us', 'p95 us', 'p99 us', 'peak KiB'))
+    for name in args.ops:
+        for size in args.sizes:
+            iterations = max(1, int(OPS[name][1] * args.scale))
+            key = '{}[{}x{}]'.format(name, size, size)
+            result = results[key] = run_case(name, size, iterations, args.rounds)
+            print('{:<24} {:>12.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f}'.format(
+                    key, result['ops_per_sec'], result['p50_us'], result['p95_us'],
+                    result['p99_us'], result['peak_kib']))
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+        print('saved baseline to ' + args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print('no baseline at {}, run with --save-baseline to create one'.format(args.baseline))
+        return 0
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    if regressions:
+        print('\nREGRESSION against {} (tolerance {:.0%}):'.format(args.baseline, args.tolerance))
+        for message in regressions: print('  ' + message)
+        return 1
+    print('\nno regressions against ' + args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Array-backed Minesweeper board. Needs NumPy, which the rest of the game
+treats as optional.
+
+The board is an int8 state array (HIDDEN, FLAG or the revealed number) plus a
+boolean mine mask. Neighbor counts are sums of the eight shifted slices of a
+zero-padded array, so they cost a handful of vectorized passes instead of a
+Python loop over every cell and its neighbor list.
+"""
+import numpy as np
+
+HIDDEN = -1
+FLAG = -2
+
+OFFSETS = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if di or dj]
+
+class Board(object):
+    """Minesweeper board held in NumPy arrays
+
+    Attributes:
+        state (ndarray of int8): HIDDEN, FLAG or the number shown in each cell
+        mines (ndarray of bool|None): True where there is a mine, None if unknown
+    """
+    def __init__(self, state, mines=None):
+        """Constructor for Board
+
+        Args:
+            state (array-like): HIDDEN, FLAG or the number shown in each cell
+            mines (array-like|None): True where there is a mine
+        """
+        super(Board, self).__init__()
+        self.state = np.asarray(state, dtype=np.int8)
+        self.mines = None if mines is None else np.asarray(mines, dtype=bool)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Board({!r}, {!r})'.format(self.state, self.mines)
+
+    def __str__(self):
+        """Define external representation when printed
+        """
+        return "\n".join("".join(row) for row in self.to_grid())
+
+    def __len__(self):
+        """Number of rows, so len() works as for list-of-lists grids"""
+        return self.state.shape[0]
+
+    @classmethod
+    def hidden(cls, gridsize, mines=()):
+        """A board with every cell hidden
+
+        Args:
+            gridsize (int): width and height of the board
+            mines (iterable of (int, int)): cells holding a mine
+        """
+        mask = np.zeros((gridsize, gridsize), dtype=bool)
+        for i, j in mines: mask[i, j] = True
+        return cls(np.full((gridsize, gridsize), HIDDEN, dtype=np.int8), mask)
+
+    @classmethod
+    def from_grid(cls, grid):
+        """Convert a list-of-lists grid of one-character strings, as used by
+            the command line game: ' ' hidden, 'F' flagged, 'X' mine, '0'-'8'
+            shown numbers. The mines are the 'X' cells, so a grid without any
+            gets an all-False mask.
+        """
+        chars = np.array(grid, dtype='U1').reshape(len(grid), len(grid[0]) if grid else 0)
+        state = np.full(chars.shape, HIDDEN, dtype=np.int8)
+        state[chars == 'F'] = FLAG
+        digits = (chars >= '0') & (chars <= '8')
+        state[digits] = chars[digits].astype(np.int8)
+        return cls(state, chars == 'X')
+
+    def to_grid(self):
+        """Convert to the list-of-lists grid of one-character strings used by
+            the command line game
+        """
+        chars = np.where(self.state >= 0, self.state.astype('U1'), ' ')
+        chars[self.state == FLAG] = 'F'
+        return chars.tolist()
+
+    @property
+    def shape(self):
+        return self.state.shape
+
+    def hidden_mask(self):
+        return self.state == HIDDEN
+
+    def flag_mask(self):
+        return self.state == FLAG
+
+    def revealed_mask(self):
+        return self.state >= 0
+
+    def neighbor_sum(self, mask, cells=None):
+        """Number of neighbors of each cell where mask is set
+
+        Args:
+            mask (ndarray of bool): cells to count
+            cells (listof (int, int)|None): only compute these cells, reading
+                just their neighbors
+
+        Returns:
+            ndarray of int8: counts shaped like the board, or one per cell in cells
+        """
+        if cells is not None:
+            return self._neighbors(mask, cells, False).sum(axis=1, dtype=np.int8)
+        padded = np.pad(mask.astype(np.int8), 1)
+        n, m = mask.shape
+        total = np.zeros((n, m), dtype=np.int8)
+        for di, dj in OFFSETS:
+            total += padded[1 + di:n + 1 + di, 1 + dj:m + 1 + dj]
+        return total
+
+    def _neighbors(self, values, cells, outside):
+        # values of the eight neighbors of each of cells, outside for neighbors
+        # off the board, as an array of shape (len(cells), 8)
+        rows, cols = np.asarray(cells, dtype=np.intp).reshape(-1, 2).T
+        n, m = values.shape
+        result = np.full((len(rows), len(OFFSETS)), outside, dtype=values.dtype)
+        for k, (di, dj) in enumerate(OFFSETS):
+            r, c = rows + di, cols + dj
+            inside = (r >= 0) & (r < n) & (c >= 0) & (c < m)
+            result[inside, k] = values[r[inside], c[inside]]
+        return result
+
+    def numbers(self):
+        """Number of neighboring mines of every cell"""
+        return self.neighbor_sum(self.mines)
+
+    def flag_counts(self, cells=None):
+        """Number of flagged neighbors, of every cell or of cells"""
+        if cells is None: return self.neighbor_sum(self.flag_mask())
+        return (self._neighbors(self.state, cells, 0) == FLAG).sum(axis=1, dtype=np.int8)
+
+    def unknown_counts(self, cells=None):
+        """Number of hidden, unflagged neighbors, of every cell or of cells"""
+        if cells is None: return self.neighbor_sum(self.hidden_mask())
+        return (self._neighbors(self.state, cells, 0) == HIDDEN).sum(axis=1, dtype=np.int8)
+
+    def frontier_mask(self):
+        """Hidden cells with at least one revealed neighbor"""
+        return self.hidden_mask() & (self.neighbor_sum(self.revealed_mask()) > 0)
+
+    def frontier(self):
+        """Set of (row, col) of the hidden cells with a revealed neighbor"""
+        return set(map(tuple, np.argwhere(self.frontier_mask()).tolist()))
+
+    def changed(self, other):
+        """Cells whose state differs from other's
+
+        Args:
+            other (Board): board to compare with, of the same shape
+
+        Returns:
+            listof (int, int)
+        """
+        return list(map(tuple, np.argwhere(self.state != other.state).tolist()))
+
+    def copy(self):
+        return Board(self.state.copy(), None if self.mines is None else self.mines.copy())
+
+    def chars(self, cells):
+        """One-character strings shown in cells, as in a list-of-lists grid
+
+        Args:
+            cells (listof (int, int)): cells to look up
+
+        Returns:
+            listof str
+        """
+        chars = []
+        for i, j in cells:
+            value = int(self.state[i, j])
+            chars.append(' ' if value == HIDDEN else 'F' if value == FLAG else str(value))
+        return chars
+
+    def update(self, other, cells):
+        """Copy the state of cells from other"""
+        if not len(cells): return
+        rows, cols = np.asarray(cells).T
+        self.state[rows, cols] = other.state[rows, cols]
@@ -0,0 +1,238 @@
+"""Constraint-propagation Minesweeper solver, an alternative engine to the rule KB.
+
+Every revealed number is a linear constraint: the unknown cells around it hold
+exactly the number minus the flags around it mines. Constraints are
+propagated with subset/difference reasoning (if A is a subset of B, B - A
+holds count(B) - count(A) mines) and, when that decides nothing, the solutions
+of each small connected part of the frontier are enumerated exactly.
+"""
+import minesweeper as ms
+
+class Constraint(object):
+    """The cells of a set of unknown cells that hold a given number of mines
+
+    Attributes:
+        cells (frozenset): unknown (row, col) cells
+        count (int): number of mines among cells
+    """
+    __slots__ = ('cells', 'count')
+
+    def __init__(self, cells, count):
+        """Constructor for Constraint
+
+        Args:
+            cells (iterable of (int, int)): unknown cells
+            count (int): number of mines among cells
+        """
+        self.cells = frozenset(cells)
+        self.count = count
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Constraint({!r}, {!r})'.format(sorted(self.cells), self.count)
+
+    def __eq__(self, other):
+        return isinstance(other, Constraint) and self.cells == other.cells \
+            and self.count == other.count
+
+    def __hash__(self):
+        return hash((self.cells, self.count))
+
+class ConstraintSolver(object):
+    """Decides frontier cells from the numbers on the board
+
+    Attributes:
+        max_component (int): largest number of cells in a connected frontier
+            component whose assignments are enumerated
+        max_constraints (int): bound on the constraints subset reasoning may
+            create in one call, to keep it from blowing up on huge frontiers
+        propagations (int): constraints derived by subset/difference reasoning
+        enumerated (int): complete assignments found by enumeration
+    """
+    def __init__(self, max_component=24, max_constraints=5000):
+        """Constructor for ConstraintSolver
+
+        Args:
+            max_component (int): largest component to enumerate
+            max_constraints (int): bound on constraints derived per call
+        """
+        super(ConstraintSolver, self).__init__()
+        self.max_component = max_component
+        self.max_constraints = max_constraints
+        self.propagations = 0
+        self.enumerated = 0
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'ConstraintSolver({!r}, {!r})'.format(self.max_component, self.max_constraints)
+
+    def constraints(self, grid):
+        """Build one constraint per revealed number that has unknown neighbors
+
+        Args:
+            grid (listof list): current board as shown to the player
+
+        Returns:
+            set of Constraint
+        """
+        constraints = set()
+        for i, row in enumerate(grid):
+            for j, ele in enumerate(row):
+                if ele == ' ' or ele == 'F': continue
+                unknown, flags = [], 0
+                for a, b in ms.getneighbors(grid, i, j):
+                    if grid[a][b] == ' ': unknown.append((a, b))
+                    elif grid[a][b] == 'F': flags += 1
+                if unknown: constraints.add(Constraint(unknown, int(ele) - flags))
+        return constraints
+
+    def propagate(self, constraints):
+        """Apply subset/difference reasoning until nothing new is derived
+
+        Args:
+            constraints (set of Constraint): constraints to start from, extended
+                in place with everything derived
+
+        Returns:
+            dictof bool: cell -> True if it must be a mine, False if it must be safe
+        """
+        decided = {}
+        pending = list(constraints)
+        by_cell = {}
+        for c in constraints:
+            for cell in c.cells: by_cell.setdefault(cell, set()).add(c)
+        while pending:
+            c = pending.pop()
+            if c.count == 0 or c.count == len(c.cells):
+                for cell in c.cells: decided[cell] = c.count > 0
+                continue
+            if len(constraints) >= self.max_constraints: continue
+            # Constraints sharing a cell with c are the only subset/superset candidates
+            others = set()
+            for cell in c.cells: others.update(by_cell[cell])
+            for other in others:
+                if other is c: continue
+                if other.cells < c.cells: small, big = other, c
+                elif c.cells < other.cells: small, big = c, other
+                else: continue
+                new = Constraint(big.cells - small.cells, big.count - small.count)
+                if new in constraints: continue
+                constraints.add(new)
+                self.propagations += 1
+                for cell in new.cells: by_cell.setdefault(cell, set()).add(new)
+                pending.append(new)
+        return decided
+
+    def components(self, constraints):
+        """Split constraints into groups that share no cells
+
+        Returns:
+            listof (listof Constraint): connected components
+        """
+        parent = {}
+        def find(cell):
+            while parent[cell] != cell:
+                parent[cell] = parent[parent[cell]]
+                cell = parent[cell]
+            return cell
+        for c in constraints:
+            cells = iter(c.cells)
+            first = next(cells)
+            parent.setdefault(first, first)
+            for cell in cells:
+                parent.setdefault(cell, cell)
+                parent[find(cell)] = find(first)
+        groups = {}
+        for c in constraints:
+            groups.setdefault(find(next(iter(c.cells))), []).append(c)
+        return list(groups.values())
+
+    def enumerate(self, constraints):
+        """Find the cells with the same value in every assignment satisfying
+            constraints, which must form one component of at most max_component
+            cells
+
+        Returns:
+            dictof bool: cell -> True if a mine in every solution, False if safe
+                in every solution
+        """
+        cells = sorted({cell for c in constraints for cell in c.cells})
+        if not cells or len(cells) > self.max_component: return {}
+        index = {cell: n for n, cell in enumerate(cells)}
+        # per constraint: cell indices, and per cell the constraints it is in
+        scopes = [[index[cell] for cell in c.cells] for c in constraints]
+        counts = [c.count for c in constraints]
+        watching = [[] for _ in cells]
+        for k, scope in enumerate(scopes):
+            for n in scope: watching[n].append(k)
+        assigned = [0] * len(constraints)     # mines assigned per constraint
+        open_ = [len(s) for s in scopes]      # unassigned cells per constraint
+        value = [0] * len(cells)
+        mines = [0] * len(cells)
+        solutions = 0
+
+        stack = [(0, 0)]
+        # iterative depth-first search, each frame is (cell index, next value to try)
+        while stack:
+            n, v = stack.pop()
+            if n == len(cells):
+                solutions += 1
+                for m in range(len(cells)): mines[m] += value[m]
+                continue
+            if v > 0:
+                # undo the previous value of cell n before trying the next
+                for k in watching[n]:
+                    assigned[k] -= value[n]
+                    open_[k] += 1
+            if v > 1: continue
+            value[n] = v
+            ok = True
+            for k in watching[n]:
+                assigned[k] += v
+                open_[k] -= 1
+                if assigned[k] > counts[k] or assigned[k] + open_[k] < counts[k]: ok = False
+            stack.append((n, v + 1))
+            if ok: stack.append((n + 1, 0))
+
+        self.enumerated += solutions
+        if not solutions: return {}
+        return {cell: mines[n] == solutions for n, cell in enumerate(cells)
+                if mines[n] in (0, solutions)}
+
+    def solve(self, grid):
+        """Decide every frontier cell that the numbers on the board determine
+
+        Args:
+            grid (listof list): current board as shown to the player
+
+        Returns:
+            dictof bool: cell -> True if it must be a mine, False if it must be safe
+        """
+        constraints = self.constraints(grid)
+        decided = self.propagate(constraints)
+        if decided: return decided
+        for component in self.components(constraints):
+            decided.update(self.enumerate(component))
+        return decided
+
+    def deduce(self, grid):
+        """Pick one decided cell, safe cells before mines
+
+        Returns:
+            ((int, int)|None, bool): the cell and whether it is a mine, like
+                minesweeper.deduceSafeCell
+        """
+        decided = self.solve(grid)
+        if not decided: return None, False
+        cell = min(decided, key=lambda c: (decided[c], c))
+        return cell, decided[cell]
+
+_solver = ConstraintSolver()
+
+def deduceSafeCell(kb, grid):
+    """Drop-in replacement for minesweeper.deduceSafeCell that ignores the KB
+        and solves the board's constraints instead
+    """
+    return _solver.deduce(grid)
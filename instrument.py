@@ -0,0 +1,130 @@
+import json
+import time
+
+COUNTERS = ('match_attempts', 'unifications', 'bc_nodes', 'rules_tried', 'facts_scanned')
+
+class Instrumentation(object):
+    """Counters and per-query trace events for a KnowledgeBase, enabled with
+        KnowledgeBase.instrument(). While no Instrumentation is attached the
+        hot paths only pay for a check against None.
+
+    Attributes:
+        callback (function|None): called with a trace event dict after every kb_ask
+        queries (int): number of kb_ask calls
+        cached (int): number of kb_ask calls answered from the table
+        match_attempts (int): calls to util.match
+        unifications (int): calls to util.match that returned bindings
+        bc_nodes (int): bc_infer_step calls
+        max_depth (int): deepest bc_infer_step recursion seen
+        rules_tried (int): rules backward_chain tried to prove a goal with
+        facts_scanned (int): candidate facts looked at by check_facts and bc_infer_step
+        query_time (float): total seconds spent in kb_ask
+    """
+    def __init__(self, callback=None):
+        """Constructor for Instrumentation
+
+        Args:
+            callback (function|None): called with a trace event dict after every kb_ask
+        """
+        super(Instrumentation, self).__init__()
+        self.callback = callback
+        self.queries = 0
+        self.cached = 0
+        self.match_attempts = 0
+        self.unifications = 0
+        self.bc_nodes = 0
+        self.max_depth = 0
+        self.rules_tried = 0
+        self.facts_scanned = 0
+        self.query_time = 0.0
+        self.query_depth = 0
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'Instrumentation({!r})'.format(self.summary())
+
+    def depth(self, depth):
+        """Record that bc_infer_step ran at depth
+        """
+        self.bc_nodes += 1
+        if depth > self.query_depth: self.query_depth = depth
+
+    def begin_query(self):
+        """Start timing a query
+
+        Returns:
+            tuple: start time and counter values to pass to end_query
+        """
+        self.query_depth = 0
+        return (time.perf_counter(),) + tuple(getattr(self, c) for c in COUNTERS)
+
+    def end_query(self, goal, start, result, cached):
+        """Finish a query started with begin_query and emit its trace event
+
+        Args:
+            goal (Statement|None): statement that was asked
+            start (tuple): value returned by begin_query
+            result (any): answer returned by kb_ask
+            cached (bool): whether the answer came from the table
+
+        Returns:
+            dict: the trace event
+        """
+        elapsed = time.perf_counter() - start[0]
+        self.queries += 1
+        self.cached += cached
+        self.query_time += elapsed
+        self.max_depth = max(self.max_depth, self.query_depth)
+        event = {'goal': str(goal), 'predicate': goal.predicate if goal is not None else None,
+                 'result': bool(result), 'cached': cached,
+                 'time_s': elapsed, 'depth': self.query_depth}
+        for counter, before in zip(COUNTERS, start[1:]):
+            event[counter] = getattr(self, counter) - before
+        if self.callback is not None: self.callback(event)
+        return event
+
+    def summary(self):
+        """Totals over every query since the instrumentation was attached
+
+        Returns:
+            dict: counter name -> value
+        """
+        totals = {c: getattr(self, c) for c in COUNTERS}
+        totals.update(queries=self.queries, cached=self.cached,
+                      max_depth=self.max_depth, query_time=self.query_time)
+        return totals
+
+def json_lines(stream):
+    """Build a callback that writes each trace event to stream as one line of JSON,
+        e.g. kb.instrument(json_lines(open('trace.jsonl', 'w')))
+
+    Args:
+        stream (file): text stream to write to
+
+    Returns:
+        function: callback taking a trace event
+    """
+    def write(event):
+        stream.write(json.dumps(event) + '\n')
+    return write
+
+def aggregate(events, key='predicate'):
+    """Sum trace events by one of their fields, by default the predicate asked
+        about to see which kind of query the time goes to
+
+    Args:
+        events (iterable of dict): trace events
+        key (str|function): event field, or function of an event, to group by
+
+    Returns:
+        dictof dict: group -> summed counters, time_s and number of queries
+    """
+    groups = {}
+    for event in events:
+        group = key(event) if callable(key) else event[key]
+        totals = groups.setdefault(group, dict.fromkeys(COUNTERS + ('time_s', 'queries'), 0))
+        for counter in COUNTERS + ('time_s',):
+            totals[counter] += event[counter]
+        totals['queries'] += 1
+    return groups
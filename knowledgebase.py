@@ -1,17 +1,49 @@
+import contextlib
 import itertools
 import time
 
 import read, copy
 from util import *
 from logical_classes import *
+from store import FactStore, RuleStore
+from rete import ReteNetwork
+from instrument import Instrumentation
 
 verbose = 0
 
+# How the KB draws conclusions, see KnowledgeBase.mode
+MODES = ('rete', 'seminaive', 'backward')
+
 class KnowledgeBase(object):
-    def __init__(self, facts=[], rules=[], file = 'minesweeper_kb.txt'):
-        self.facts = facts
-        self.rules = rules
+    """Facts and rules with forward and backward chaining
+
+    Attributes:
+        mode (str): how conclusions are drawn. 'rete' forward chains every
+            added fact through the Rete network and backward chains the goals
+            it has no fact for. 'seminaive' saturates the KB after each batch
+            of facts with a semi-naive fixpoint (see saturate), so every
+            conclusion is a fact and asks are index lookups. 'backward' only
+            backward chains, per asked goal.
+        listeners (dictof list): predicate -> functions called with (fact, added)
+            when a fact with that predicate enters or leaves the store, see listen
+    """
+    def __init__(self, facts=[], rules=[], file = 'minesweeper_kb.txt', mode='rete'):
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}, not {!r}'.format(MODES, mode))
+        self.mode = mode
+        self.facts = FactStore(facts)
+        self.rules = RuleStore(rules)
         self.ie = InferenceEngine()
+        self.rete = ReteNetwork()
+        self.table = {}
+        self.table_deps = {}
+        self.table_hits = 0
+        self.table_misses = 0
+        self._dependencies = {}
+        self._deferred = []
+        self.instrumentation = None
+        self._undo = None
+        self.listeners = {}
         self.setUp(file)
 
     def __repr__(self):
@@ -26,8 +58,7 @@ class KnowledgeBase(object):
     def setUp(self, file):
         # Assert starter facts
         self.data = read.read_tokenize(file)
-        data = read.read_tokenize(file)
-        for item in data:
+        for item in self.data:
             if isinstance(item, Fact) or isinstance(item, Rule):
                 self.kb_add(item)
 
@@ -35,22 +66,79 @@ class KnowledgeBase(object):
         """ Args: fact (Fact): Fact we're searching for
             Returns: Fact: matching fact
         """
-        for kbfact in self.facts:
-            if fact == kbfact:
-                return kbfact
+        return self.facts.get(fact)
 
     def _get_rule(self, rule):
         """ Args: rule (Rule): Rule we're searching for
             Returns: Rule: matching rule
         """
-        for kbrule in self.rules:
-            if rule == kbrule:
-                return kbrule
+        return self.rules.get(rule)
 
     def kb_add_parse(self, text):
         parsed = read.parse_input(text)
         self.kb_add(parsed)
 
+    def assert_fact(self, predicate, *args):
+        """Assert a fact from its predicate and arguments, without going through
+            text parsing, e.g. kb.assert_fact('safe', 'c34')
+
+        Args:
+            predicate (str): predicate of the fact
+            *args (str): arguments of the fact
+
+        Returns:
+            Fact: the fact as stored in the KB
+        """
+        fact = Fact(Statement((predicate,) + args))
+        self.kb_add(fact)
+        return self.facts.get(fact)
+
+    def assert_facts(self, statements, infer=True):
+        """Assert a batch of facts given as (predicate, arg, ...) tuples through
+            kb_add_many
+
+        Args:
+            statements (iterable of tuple): predicate followed by arguments
+            infer (bool): passed on to kb_add_many
+
+        Returns:
+            listof Fact: the facts that were not already in the KB
+        """
+        return self.kb_add_many((Fact(Statement(s)) for s in statements), infer)
+
+    def retract_fact(self, predicate, *args):
+        """Retract a fact given by its predicate and arguments
+
+        Args:
+            predicate (str): predicate of the fact
+            *args (str): arguments of the fact
+        """
+        self.kb_retract(Fact(Statement((predicate,) + args)))
+
+    def ask(self, predicate, *args):
+        """Ask about a statement given by its predicate and arguments, e.g.
+            kb.ask('safe', 'c34') or kb.ask('nextTo', 'c34', '?c')
+
+        Args:
+            predicate (str): predicate of the statement
+            *args (str): arguments, constants or variables starting with '?'
+
+        Returns:
+            listof dict: one dict per answer mapping variable names to the values
+                bound to them. A ground statement gives [{}] if it is entailed
+                and [] if not. A statement with variables gives an answer per
+                matching fact, including facts inferred by forward chaining.
+        """
+        statement = Statement((predicate,) + args)
+        if not any(is_var(term) for term in statement.terms):
+            return [{}] if self.kb_ask(Fact(statement)) else []
+        if self._deferred: self.infer()
+        answers = []
+        for fact in self.facts.candidates(statement):
+            bindings = match(statement, fact.statement, None, frozenset(), self.instrumentation)
+            if bindings: answers.append(dict(bindings.bindings_dict))
+        return answers
+
     def kb_add(self, fact_rule):
         """Add a fact or rule to the KB"""
         #printv("Adding {!r}", 1, verbose, [fact_rule])
@@ -60,220 +148,734 @@ class KnowledgeBase(object):
         elif isinstance(fact_rule, Rule):
             self._kb_add_rule(fact_rule)
 
+    def kb_add_many(self, facts_rules, infer=True):
+        """Add a batch of facts and rules. The whole batch is deduplicated and
+            indexed first, then inference runs on the new facts in one pass
+            (see infer) and their conclusions are added as another batch.
+
+        Args:
+            facts_rules (iterable of Fact|Rule): facts and rules to add
+            infer (bool): run inference on the new facts now. If False they are
+                only indexed, and inference on them is deferred until the next
+                kb_add, kb_ask, kb_retract or infer call.
+
+        Returns:
+            listof Fact: the facts that were not already in the KB
+        """
+        new_facts = []
+        for item in facts_rules:
+            if isinstance(item, Rule):
+                self._kb_add_rule(item)
+            elif isinstance(item, Fact):
+                kb_fact = self.facts.get(item)
+                if kb_fact is None:
+                    self.facts.append(item)
+                    if self._undo is not None: self._undo.append((self._unadd_fact, item))
+                    if self.listeners: self._notify(item, True)
+                    self._deferred.append(item)
+                    new_facts.append(item)
+                else:
+                    self._merge_fact(kb_fact, item)
+        for predicate in {fact.statement.predicate for fact in new_facts}:
+            self._table_invalidate(predicate, True)
+        if infer: self.infer()
+        return new_facts
+
+    def infer(self):
+        """Run inference on the facts whose inference was deferred by
+            kb_add_many and add their conclusions: through the Rete network in
+            'rete' mode, to a fixpoint with saturate in 'seminaive' mode and not
+            at all in 'backward' mode
+        """
+        if self.mode == 'seminaive': return self.saturate()
+        if self.mode == 'backward': return self._deferred.clear()
+        while self._deferred:
+            pending, self._deferred = self._deferred, []
+            matches = []
+            for fact in pending:
+                matches.extend(self.rete.add_fact(fact))
+            if matches: self._kb_add_matches(matches)
+
     def _kb_add_fact(self, fact):
-        # t0 = time.time()
-        if fact not in self.facts:
+        if self._deferred: self.infer()
+        kb_fact = self.facts.get(fact)
+        if kb_fact is None:
             self.facts.append(fact)
-            # for rule in self.rules:
-            #     self.ie.fc_infer(fact, rule, self)
-        else:
-            if fact.supported_by:
-                ind = self.facts.index(fact)
-                for f in fact.supported_by:
-                    self.facts[ind].supported_by.append(f)
+            if self._undo is not None: self._undo.append((self._unadd_fact, fact))
+            if self.listeners: self._notify(fact, True)
+            self._table_invalidate(fact.statement.predicate, True)
+            if self.mode == 'rete':
+                self._kb_add_matches(self.rete.add_fact(fact))
             else:
-                ind = self.facts.index(fact)
-                self.facts[ind].asserted = True
-        # t1 = time.time()
-        # print("adding fact took: " + str(t1-t0))
+                self._deferred.append(fact)
+                self.infer()
+        else:
+            self._merge_fact(kb_fact, fact)
+
+    def _merge_fact(self, kb_fact, fact):
+        """Merge a fact that is already in the KB into the stored copy"""
+        if self._undo is not None:
+            for key in fact.supported_by:
+                if key not in kb_fact.supported_by:
+                    self._undo.append((kb_fact.supported_by.pop, key))
+            if not fact.supported_by and not kb_fact.asserted:
+                self._undo.append((setattr, kb_fact, 'asserted', False))
+        if fact.supported_by:
+            kb_fact.supported_by.update(fact.supported_by)
+        else:
+            kb_fact.asserted = True
 
     def _kb_add_rule(self, rule):
-        # t0 = time.time()
-        # print("adding rule")
-        # print(rule)
+        if self._undo is not None:
+            raise ValueError('rules cannot be added inside hypothetically()')
+        if self._deferred: self.infer()
         if rule not in self.rules:
             self.rules.append(rule)
-            for fact in self.facts:
-                self.ie.fc_infer(fact, rule, self)
+            self._dependencies.clear()
+            self.clear_table()
+            if self.mode == 'rete':
+                self._kb_add_matches(self.rete.add_rule(rule, self.facts))
+            elif self.mode == 'seminaive':
+                # Every match of a new rule has some fact for its first premise
+                derived = []
+                for fact in self.facts.candidates(rule.lhs[0]):
+                    self._delta_matches(rule, 0, fact, frozenset(), derived)
+                if derived: self._kb_add_derived(derived)
         else:
+            kb_rule = self.rules.get(rule)
             if rule.supported_by:
-                ind = self.rules.index(rule)
-                for f in rule.supported_by:
-                    self.rules[ind].supported_by.append(f)
+                kb_rule.supported_by.update(rule.supported_by)
             else:
-                ind = self.rules.index(rule)
-                self.rules[ind].asserted = True
-        # t1 = time.time()
-        # print("adding rule took: " + str(t1-t0))
+                kb_rule.asserted = True
+
+    def _kb_add_matches(self, matches):
+        """Add the conclusions of complete rule matches found by the Rete network,
+            supported by the matched facts and the rule
+
+        Args:
+            matches (listof (Rule, tuple)): rule and the facts matched against its LHS
+        """
+        self._kb_add_derived([(self.rete.conclusion(rule, token), token + (rule,))
+                              for rule, token in matches])
+
+    def _kb_add_derived(self, derived, infer=True):
+        """Add derived statements as facts supported by what they were derived from
+
+        Args:
+            derived (listof (Statement, tuple)): statement and its justification,
+                the matched facts followed by the rule
+            infer (bool): passed on to kb_add_many
+        """
+        derived = [(Fact(stmt, [support]), support) for stmt, support in derived]
+        self.kb_add_many([fact for fact, support in derived], infer)
+        for fact, support in derived:
+            kb_fact = self.facts.get(fact)
+            for item in support:
+                if self._undo is not None and kb_fact.statement not in item.supports_facts:
+                    self._undo.append((item.supports_facts.pop, kb_fact.statement))
+                item.supports_facts[kb_fact.statement] = kb_fact
+
+    def saturate(self):
+        """Derive everything the rules entail from the facts whose inference
+            was deferred, by semi-naive evaluation: each round only joins the
+            facts that are new since the last round (the delta) against the
+            rules, and its conclusions are the next round's delta, until a round
+            derives nothing new. A match is only found in the round its last
+            fact arrived in, and from the delta fact at its first delta premise,
+            so no match is joined twice.
+        """
+        while self._deferred:
+            delta, self._deferred = self._deferred, []
+            new = {fact.statement for fact in delta}
+            derived = []
+            ready = {}
+            for fact in delta:
+                predicate = fact.statement.predicate
+                for rule in self.rules.using(predicate):
+                    if rule not in ready:
+                        # no matches this round if a premise has no facts at all
+                        ready[rule] = all(self.facts.estimate(p) for p in rule.lhs)
+                    if not ready[rule]: continue
+                    for k, premise in enumerate(rule.lhs):
+                        if premise.predicate == predicate:
+                            self._delta_matches(rule, k, fact, new, derived)
+            if derived: self._kb_add_derived(derived, False)
+
+    def _delta_matches(self, rule, k, fact, delta, derived):
+        """Find the matches of the LHS of rule with fact for premise k and
+            facts that are not in delta for the premises before k
+
+        Args:
+            rule (Rule): rule to match
+            k (int): index of the premise fact is matched against
+            fact (Fact): new fact
+            delta (set of Statement): statements of the facts new this round
+            derived (list): (conclusion, justification) of each match is appended here
+        """
+        bindings = match(rule.lhs[k], fact.statement, None, frozenset(), self.instrumentation)
+        if not bindings: return
+        token = [None] * len(rule.lhs)
+        token[k] = fact
+        self._join(rule, k, token, bindings, delta, derived)
+
+    def _join(self, rule, k, token, bindings, delta, derived):
+        # Extend a partial match one premise at a time, the premise with the
+        # fewest estimated facts given the bindings so far first
+        best = None
+        for j, premise in enumerate(rule.lhs):
+            if token[j] is not None: continue
+            pattern = instantiate(premise, bindings)
+            estimate = self.facts.estimate(pattern)
+            if best is None or estimate < best[2]: best = (j, pattern, estimate)
+            if not estimate: return
+        if best is None:
+            derived.append((instantiate(rule.rhs, bindings), tuple(token) + (rule,)))
+            return
+        j, pattern, _ = best
+        for fact in self.facts.candidates(pattern):
+            if j < k and fact.statement in delta: continue
+            mark = bindings.mark()
+            if match(pattern, fact.statement, bindings, frozenset(), self.instrumentation):
+                token[j] = fact
+                self._join(rule, k, token, bindings, delta, derived)
+                token[j] = None
+            bindings.undo(mark)
 
     def is_violation(self, cell, safe_or_bomb):
         """Returns if adding a fact to the knowledgebase causes a logical inconsistancy"""
-        fact = read.parse_input("fact: ("+safe_or_bomb+" "+cell+")")
-        #printv("Asserting {!r}", 0, verbose, [fact])
-        self.kb_add(fact)
-        isViolation = read.parse_input("fact: (violation "+cell+")")
-        self.kb_ask(isViolation)
-        self.kb_retract(fact)
-        return isViolation
+        with self.hypothetically(Fact(Statement([safe_or_bomb, cell]))):
+            return bool(self.kb_ask(Fact(Statement(['violation', cell]))))
+
+    @contextlib.contextmanager
+    def hypothetically(self, *facts):
+        """Assert facts for the duration of a with block and then undo every
+            change made to the KB inside it, e.g.
+
+                with kb.hypothetically(('bomb', 'c3_4')):
+                    contradiction = kb.ask('violation', 'c3_4')
+
+            Changes are recorded in an undo log as they happen, so rolling back
+            costs time proportional to what changed, not to the size of the KB.
+            Hypotheses nest, each one rolls back only its own changes. Facts can
+            be asserted and retracted inside the block, rules cannot be added.
+
+        Args:
+            *facts (Fact|Statement|tuple): facts to assume, tuples are
+                (predicate, arg, ...)
+
+        Yields:
+            KnowledgeBase: this KB
+        """
+        if self._deferred: self.infer()
+        outer = self._undo
+        if outer is None: self._undo = []
+        mark = len(self._undo)
+        try:
+            for fact in facts:
+                self.kb_add(fact if isinstance(fact, Fact) else Fact(fact))
+            yield self
+        finally:
+            self._rollback(mark)
+            if outer is None: self._undo = None
+
+    def _rollback(self, mark):
+        """Undo the changes logged since the undo log had mark entries"""
+        self._deferred.clear()
+        # the undo steps must not log themselves
+        log, self._undo = self._undo, None
+        try:
+            while len(log) > mark:
+                undo, *args = log.pop()
+                undo(*args)
+        finally:
+            self._undo = log
+
+    def _unadd_fact(self, fact):
+        # undo of adding fact to the store and Rete network
+        self.rete.remove_fact(fact)
+        self.facts.remove(fact)
+        if self.listeners: self._notify(fact, False)
+
+    def _restore(self, item, supports_facts, supports_rules):
+        # undo of _kb_retract_recursive removing item
+        if isinstance(item, Fact):
+            self.facts.append(item)
+            self.rete.add_fact(item)
+            if self.listeners: self._notify(item, True)
+        else:
+            self.rules.append(item)
+        item.supports_facts.update(supports_facts)
+        item.supports_rules.update(supports_rules)
+
+    def _untable(self, stmt):
+        # undo of _table_answer caching the answer to stmt
+        polarity = bool(self.table.pop(stmt))
+        for predicate in self._table_dependencies(stmt.predicate):
+            self.table_deps.get((predicate, polarity), set()).discard(stmt)
+
+    def listen(self, predicate, callback):
+        """Call callback(fact, added) whenever a fact with predicate is added to
+            or removed from the KB, whether it was asserted, derived by forward
+            or backward chaining, retracted or undone by hypothetically(), e.g.
+            to keep a view of the (safe ?c) facts up to date
+
+        Args:
+            predicate (str): predicate of the facts to report
+            callback (function): called with the Fact and True if it was added,
+                False if it was removed
+        """
+        self.listeners.setdefault(predicate, []).append(callback)
+
+    def unlisten(self, predicate, callback):
+        """Stop calling a callback registered with listen
+
+        Raises:
+            ValueError: if callback is not listening to predicate
+        """
+        callbacks = self.listeners.get(predicate, [])
+        callbacks.remove(callback)
+        if not callbacks: self.listeners.pop(predicate, None)
+
+    def _notify(self, fact, added):
+        for callback in self.listeners.get(fact.statement.predicate, ()):
+            callback(fact, added)
+
+    def instrument(self, callback=None):
+        """Start counting the work done by queries. Until this is called the
+            engine keeps no counters.
+
+        Args:
+            callback (function|None): called with a trace event dict after every
+                kb_ask, see instrument.json_lines for writing them to a file
+
+        Returns:
+            Instrumentation: the counters, also available as kb.instrumentation
+        """
+        self.instrumentation = Instrumentation(callback)
+        return self.instrumentation
+
+    def uninstrument(self):
+        """Stop counting and detach the Instrumentation
+
+        Returns:
+            Instrumentation|None: the counters collected so far
+        """
+        inst = self.instrumentation
+        self.instrumentation = None
+        return inst
 
     def kb_ask(self, f):
         """Ask if a fact is in the KB
         Args: fact (Fact) - Statement to be asked (will be converted into a Fact)
         Returns: listof Bindings|False - list of Bindings if result found, False otherwise
         """
+        inst = self.instrumentation
+        if inst is None: return self._kb_ask(f)
+        start = inst.begin_query()
+        hits = self.table_hits
+        result = self._kb_ask(f)
+        inst.end_query(f.statement if factq(f) else None, start, result,
+                       self.table_hits != hits)
+        return result
+
+    def _kb_ask(self, f):
         #print("Asking {!r}".format(f))
+        if self._deferred: self.infer()
         if factq(f):
-            # ask matched facts
-            if bindings := self.check_facts(f): return bindings
+            stmt = f.statement
+            if stmt in self.table:
+                self.table_hits += 1
+                return self.table[stmt]
+            self.table_misses += 1
 
-            # check rules if no facts found
-            backward_result = self.backward_chain(f)
+            # ask matched facts
+            if not (result := self.check_facts(f)) and self.mode != 'seminaive':
+                # check rules if no facts found, a saturated KB has every
+                # conclusion as a fact already
+                result = self.backward_chain(f)
 
-            return backward_result
+            self._table_answer(stmt, result)
+            return result
 
         else:
             #print("Invalid ask:", f.statement)
             return []
 
+    def _table_answer(self, stmt, result):
+        """Cache the answer to a goal, filed under every predicate it depends on
+            and whether it was proven, so kb_add/kb_retract can drop exactly the
+            answers a change can affect
+
+        Args:
+            stmt (Statement): goal that was asked
+            result (Bindings|bool): answer to cache
+        """
+        if self._undo is not None: self._undo.append((self._untable, stmt))
+        self.table[stmt] = result
+        polarity = bool(result)
+        for predicate in self._table_dependencies(stmt.predicate):
+            self.table_deps.setdefault((predicate, polarity), set()).add(stmt)
+
+    def _table_dependencies(self, predicate):
+        """Predicates whose facts can affect the answer to a goal with predicate,
+            i.e. the goal predicate and everything reachable through rule LHSs
+        """
+        deps = self._dependencies.get(predicate)
+        if deps is None:
+            deps = {predicate}
+            pending = [predicate]
+            while pending:
+                head = pending.pop()
+                for rule in self.rules.concluding(head):
+                    for stmt in rule.lhs:
+                        if stmt.predicate not in deps:
+                            deps.add(stmt.predicate)
+                            pending.append(stmt.predicate)
+            self._dependencies[predicate] = deps
+        return deps
+
+    def _table_invalidate(self, predicate, added):
+        """Drop cached answers that a change to facts with predicate can affect.
+            Rules have no negation, so adding a fact can only turn unproven goals
+            into proven ones and removing one can only do the reverse.
+
+        Args:
+            predicate (str): predicate of the added or removed fact
+            added (bool): True if a fact was added, False if one was removed
+        """
+        for stmt in self.table_deps.pop((predicate, not added), ()):
+            result = self.table.pop(stmt, None)
+            if self._undo is not None and result is not None:
+                self._undo.append((self._table_answer, stmt, result))
+
+    def clear_table(self):
+        """Drop every cached answer"""
+        if self._undo is not None:
+            for stmt, result in self.table.items():
+                self._undo.append((self._table_answer, stmt, result))
+        self.table.clear()
+        self.table_deps.clear()
+
     def check_facts(self, f):
         if isinstance(f,Fact): stmt = f.statement
         elif isinstance(f,Statement): stmt = f
         else: return False
         # print("checking",stmt)
-        for fact in self.facts:
-            binding = match(stmt, fact.statement)
+        candidates = self.facts.candidates(stmt)
+        if self.instrumentation is not None:
+            self.instrumentation.facts_scanned += len(candidates)
+        for fact in candidates:
+            binding = match(stmt, fact.statement, None, frozenset(), self.instrumentation)
             if binding:
                 # print("returning true")
                 return binding
         # print("returning false")
         return False
 
-    def backward_chain(self, f):
-        for rule in self.rules:
-            binding = match(f.statement, rule.rhs)
-            if binding and binding.bindings:
+    def backward_chain(self, f, plan=None):
+        for rule in self.rules.candidates(f.statement):
+            binding = match(f.statement, rule.rhs, None, frozenset(), self.instrumentation)
+            if binding and binding.trail:
+                if self.instrumentation is not None: self.instrumentation.rules_tried += 1
                 # print("bindings")
                 # print(binding)
-                is_entailed = self.ie.bc_infer(binding, f, rule, self)
+                steps = None
+                if plan is not None:
+                    steps = []
+                    plan.rules.append((rule, steps))
+                is_entailed = self.ie.bc_infer(binding, f, rule, self, steps)
                 if is_entailed: return True
         return False
 
+    def kb_explain(self, f):
+        """Answer f without the table and report the plan the engine used
+
+        Args:
+            f (Fact): fact to ask about
+
+        Returns:
+            QueryPlan: where the answer came from and, for every rule tried, the
+                premise order chosen with estimated vs actual result sizes
+        """
+        plan = QueryPlan(f.statement)
+        if self.check_facts(f): plan.source = 'fact'
+        elif self.backward_chain(f, plan): plan.source = 'rule'
+        return plan
+
     def kb_retract(self, fact):
         """Retract a fact from the KB"""
         #printv("Retracting {!r}", 0, verbose, [fact])
         if isinstance(fact, Rule): return
+        if self._deferred: self.infer()
 
-        kb_fact = self.facts[self.facts.index(fact)]
-        if kb_fact.supported_by: kb_fact.asserted = False
-        else: self._kb_retract_recursive(kb_fact)
+        kb_fact = self.facts.get(fact)
+        if kb_fact is None: return
+        if self._undo is not None and kb_fact.asserted:
+            self._undo.append((setattr, kb_fact, 'asserted', True))
+        kb_fact.asserted = False
+        self._kb_retract_recursive(kb_fact)
 
     def _kb_retract_recursive(self, fact_rule):
-        for supported in itertools.chain(fact_rule.supports_facts, fact_rule.supports_rules):
-            self._clean_up_supported_by(supported, fact_rule)
-            if not supported.asserted and not supported.supported_by:
-                self._kb_retract_recursive(supported)
-        self.facts.remove(fact_rule) if isinstance(fact_rule, Fact) else self.rules.remove(fact_rule)
+        """Remove fact_rule, if it is no longer asserted, and every fact or rule
+            that is no longer entailed because of it, DRed-style: first every
+            unasserted item that depends on fact_rule is taken as suspect, then
+            the suspects with a justification made only of items that are not
+            suspect, or that have already been re-derived, are re-derived, and
+            the rest are removed. Facts that only justify each other through
+            recursive rules therefore go together. The cost is proportional to
+            the number of conclusions that depended on fact_rule.
+
+        Args:
+            fact_rule (Fact|Rule): stored fact or rule that lost its assertion
+                or a justification
+        """
+        suspects = {fact_rule.key: fact_rule}
+        worklist = [fact_rule]
+        while worklist:
+            item = worklist.pop()
+            for supported in itertools.chain(item.supports_facts.values(),
+                                             item.supports_rules.values()):
+                if not supported.asserted and supported.key not in suspects:
+                    suspects[supported.key] = supported
+                    worklist.append(supported)
+
+        rederived = set()
+        def grounded(item):
+            return item.asserted or any(
+                all(other.key not in suspects or other.key in rederived
+                    for other in justification)
+                for justification in item.supported_by.values())
+        worklist = [item for item in suspects.values() if grounded(item)]
+        rederived.update(item.key for item in worklist)
+        while worklist:
+            item = worklist.pop()
+            for supported in itertools.chain(item.supports_facts.values(),
+                                             item.supports_rules.values()):
+                key = supported.key
+                if key in suspects and key not in rederived and grounded(supported):
+                    rederived.add(key)
+                    worklist.append(supported)
+
+        for key, item in suspects.items():
+            if key in rederived: continue
+            for supported in list(itertools.chain(item.supports_facts.values(),
+                                                  item.supports_rules.values())):
+                self._clean_up_supported_by(supported, key)
+            if self._undo is not None:
+                self._undo.append((self._restore, item, dict(item.supports_facts),
+                                   dict(item.supports_rules)))
+            item.supports_facts.clear()
+            item.supports_rules.clear()
+            if isinstance(item, Fact):
+                self.rete.remove_fact(item)
+                self.facts.remove(item)
+                self._table_invalidate(item.statement.predicate, False)
+                if self.listeners: self._notify(item, False)
+            else:
+                self.rules.remove(item)
+                self._dependencies.clear()
+                self.clear_table()
+
+    def _clean_up_supported_by(self, fact_rule, key):
+        """Drop the justifications of fact_rule that use the item with key. The
+            other members of a dropped justification stop listing fact_rule as
+            something they support unless another justification still uses them.
+
+        Args:
+            fact_rule (Fact|Rule): fact or rule whose justifications to clean up
+            key (Statement|tuple): key of the fact or rule being removed
+        """
+        dropped = [k for k in fact_rule.supported_by if key in k]
+        if not dropped: return
+        justifications = [fact_rule.supported_by.pop(k) for k in dropped]
+        if self._undo is not None:
+            for k, justification in zip(dropped, justifications):
+                self._undo.append((fact_rule.supported_by.__setitem__, k, justification))
+        remaining = {item_key for k in fact_rule.supported_by for item_key in k}
+        own_key = fact_rule.key
+        for justification in justifications:
+            for other in justification:
+                if other.key == key or other.key in remaining: continue
+                supports = other.supports_facts if isinstance(fact_rule, Fact) else other.supports_rules
+                if self._undo is not None and own_key in supports:
+                    self._undo.append((supports.__setitem__, own_key, supports[own_key]))
+                supports.pop(own_key, None)
+
+
+class PlanStep(object):
+    """A premise chosen by the planner in bc_infer_step, with the estimated and
+        actual size of its intermediate result
+
+    Attributes:
+        depth (int): recursion depth the premise was solved at
+        statement (Statement): premise as instantiated when it was chosen
+        estimate (int): estimated number of matching facts
+        scanned (int): candidate facts the index returned
+        matched (int): candidate facts that unified with the premise
+    """
+    def __init__(self, depth, statement, estimate):
+        """Constructor for PlanStep
+
+        Args:
+            depth (int): recursion depth the premise was solved at
+            statement (Statement): premise as instantiated when it was chosen
+            estimate (int): estimated number of matching facts
+        """
+        super(PlanStep, self).__init__()
+        self.depth = depth
+        self.statement = statement
+        self.estimate = estimate
+        self.scanned = 0
+        self.matched = 0
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'PlanStep({!r}, {!r}, {!r}, {!r}, {!r})'.format(
+                self.depth, self.statement, self.estimate, self.scanned, self.matched)
+
+    def __str__(self):
+        """Define external representation when printed
+        """
+        return "{}{!s}  est: {}  scanned: {}  matched: {}".format(
+                "    " * (self.depth + 1), self.statement, self.estimate,
+                self.scanned, self.matched)
+
+class QueryPlan(object):
+    """Record of how a query was answered, produced by KnowledgeBase.kb_explain
+
+    Attributes:
+        goal (Statement): statement that was asked
+        source (str): 'fact' if answered from facts, 'rule' if proven by a rule,
+            None if not entailed
+        rules (listof (Rule, listof PlanStep)): rules tried and the premises the
+            planner chose for each, in the order they were solved
+    """
+    def __init__(self, goal):
+        """Constructor for QueryPlan
 
-    def _clean_up_supported_by(self, fact_rule, item):
-        for i,pair in enumerate(fact_rule.supported_by):
-            if item in pair: fact_rule.supported_by.pop(i)
+        Args:
+            goal (Statement): statement that was asked
+        """
+        super(QueryPlan, self).__init__()
+        self.goal = goal
+        self.source = None
+        self.rules = []
 
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'QueryPlan({!r}, {!r}, {!r})'.format(self.goal, self.source, self.rules)
 
+    def __str__(self):
+        """Define external representation when printed
+        """
+        string = "Plan for " + str(self.goal) + ": " + str(self.source) + "\n"
+        for rule, steps in self.rules:
+            string += "  " + " ".join(str(s) for s in rule.lhs) + " -> " + str(rule.rhs) + "\n"
+            string += "".join(str(step) + "\n" for step in steps)
+        return string
 
 class InferenceEngine(object):
-    def bc_infer(self, bindings, fact, rule, kb):
-        """Forward-chaining to infer new facts and rules
+    def bc_infer(self, bindings, fact, rule, kb, plan=None):
+        """Backward-chaining to prove fact from rule
 
         Args:
-            fact (Fact) - A fact from the KnowledgeBase
+            bindings (Bindings) - bindings from matching fact against the RHS of rule
+            fact (Fact) - A fact being asked about
             rule (Rule) - A rule from the KnowledgeBase
             kb (KnowledgeBase) - A KnowledgeBase
+            plan (listof PlanStep|None) - if given, the chosen premises are recorded here
 
         Returns:
-            Nothing
+            Rule|False: rule instantiated with the facts that prove fact, False if
+                it cannot be proven
         """
         #printv('Attempting to infer from {!r} and {!r} => {!r}', 1, verbose,
             # [fact.statement, rule.lhs, rule.rhs])
 
-        if not bindings or len(bindings.bindings) ==  0: return False
+        if not bindings or not bindings.trail: return False
 
-        # if bindings := self._get_rule_bindings(fact, rule):
         lhs = [instantiate(stmt,bindings) for stmt in rule.lhs]
-        # lhs = [ns for stmt in rule.lhs
-        #            if (ns := instantiate(stmt,bindings)) != fact.statement]
         rhs = instantiate(rule.rhs, bindings)
         test_rule = Rule([lhs, rhs], [])
-        # print("test rule:",test_rule)
-        entailed_rule = self.bc_infer_step(test_rule, kb, [])
-        # print("entailed",is_entailed)
-        if entailed_rule:
-            kb.kb_add(Fact(rhs, [entailed_rule]))
+        entailed_rule = self.bc_infer_step(test_rule, kb, frozenset(), plan)
+        if not entailed_rule: return False
+        token = tuple(kb.facts.get(stmt) for stmt in entailed_rule.lhs)
+        # only record a conclusion every premise of which is a stored fact
+        if None in token: return False
+        kb._kb_add_derived([(entailed_rule.rhs, token + (rule,))])
         return entailed_rule
 
-    def bc_infer_step(self, rule, kb, used_terms = []):
-        # print()
-        # print("step",rule)
-        for kb_fact in kb.facts:
-            # if str(kb_fact.statement).startswith("(near1Bomb"): print(kb_fact.statement, used_terms)
-            if fact_bindings := self._get_rule_bindings(kb_fact, rule, used_terms):
-                # if str(kb_fact.statement).startswith("(near1Bomb"): print(fact_bindings)
-                # print("Final Bindings",fact_bindings)
-                if len(fact_bindings.bindings) == 0: continue
-                new_rule = self.get_new_rule(rule, kb_fact, fact_bindings, kb)
-                new_rule = self.get_new_rule(rule, kb_fact, fact_bindings, kb)
-                if not new_rule: continue
-                next_used_terms = used_terms.copy()
-                next_used_terms.extend(fact_bindings.bindings_dict.values())
-                # print("used terms",next_used_terms)
-                # print("has unknown",  rule_has_unknown(new_rule))
-                if rule_has_unknown(new_rule):
-                    entailed_rule = self.bc_infer_step(new_rule, kb, next_used_terms)
-                    if entailed_rule:
-                        # add suppported by kb_fact, entailed_rule
-                        new_rule.supported_by.append((kb_fact, entailed_rule))
-                        return new_rule
-                    else: continue
-                else:
-                    return new_rule
-        return False
+    def bc_infer_step(self, rule, kb, used_terms=frozenset(), plan=None, depth=0):
+        """Find facts for the LHS statements of rule that still have variables,
+            one premise per recursion level. At each level the planner picks the
+            premise with the fewest estimated matches given what is bound so far,
+            e.g. (nextTo ?t c34) before (near3bomb ?t) once ?c is bound.
 
-    def get_new_rule(self, rule, fact, bindings, kb):
-        new_lhs = [instantiate(stmt,bindings) for stmt in rule.lhs]
-        # new_lhs = [ns for stmt in rule.lhs
-        #            if (ns := instantiate(stmt,bindings)) != fact.statement]
-        new_rhs = instantiate(rule.rhs, bindings)
-        new_rule = Rule([new_lhs,new_rhs], [])
-        # print()
-        # print("bindings found",bindings)
-        # print(new_rule)
-        for stmt in new_lhs:
-            if not is_variable(stmt) and not kb.check_facts(stmt): return False
-        return new_rule
+        Args:
+            rule (Rule) - partially instantiated rule to prove
+            kb (KnowledgeBase) - A KnowledgeBase
+            used_terms (frozenset of str) - values already bound at earlier levels
+            plan (listof PlanStep|None) - if given, the chosen premises are recorded here
+            depth (int) - recursion depth
 
+        Returns:
+            Rule|False: rule fully instantiated from facts, False if there is none
+        """
+        inst = kb.instrumentation
+        if inst is not None: inst.depth(depth)
+        stmt, estimate = self.plan_next(rule, kb)
+        if stmt is None:
+            # every premise is ground, check them like get_new_rule does
+            for premise in rule.lhs:
+                if not kb.check_facts(premise): return False
+            return rule
+        step = None
+        if plan is not None:
+            step = PlanStep(depth, stmt, estimate)
+            plan.append(step)
+        candidates = kb.facts.candidates(stmt)
+        if step: step.scanned = len(candidates)
+        if inst is not None: inst.facts_scanned += len(candidates)
+        for kb_fact in candidates:
+            fact_bindings = match(stmt, kb_fact.statement, None, used_terms, inst)
+            if not fact_bindings or not fact_bindings.trail: continue
+            if step: step.matched += 1
+            new_rule = self.get_new_rule(rule, kb_fact, fact_bindings, kb)
+            if not new_rule: continue
+            if rule_has_unknown(new_rule):
+                next_used_terms = used_terms.union(fact_bindings.elements())
+                entailed_rule = self.bc_infer_step(new_rule, kb, next_used_terms, plan, depth + 1)
+                if entailed_rule: return entailed_rule
+            else:
+                return new_rule
+        return False
 
-    def fc_infer(self, fact, rule, kb):
-        """Forward-chaining to infer new facts and rules
+    def plan_next(self, rule, kb):
+        """Choose the LHS statement of rule to solve next: the one with variables
+            that the fact index estimates has the fewest matches
 
         Args:
-            fact (Fact) - A fact from the KnowledgeBase
-            rule (Rule) - A rule from the KnowledgeBase
+            rule (Rule) - partially instantiated rule
             kb (KnowledgeBase) - A KnowledgeBase
 
         Returns:
-            Nothing
+            (Statement, int)|(None, None): chosen statement and its estimated
+                number of matches, or None if every statement is ground
         """
-        #printv('Attempting to infer from {!r} and {!r} => {!r}', 1, verbose,
-            # [fact.statement, rule.lhs, rule.rhs])
-
-        if bindings := self._get_rule_bindings(fact, rule):
-            new_lhs = [ns for stmt in rule.lhs
-                       if (ns := instantiate(stmt,bindings)) != fact.statement]
-            new_rhs = instantiate(rule.rhs, bindings)
-            new_fact_rule = Fact(new_rhs, [(fact,rule)]) if not new_lhs \
-                else Rule([new_lhs,new_rhs], [(fact,rule)])
-
-            fact.supports_rules.append(new_fact_rule)
-            rule.supports_rules.append(new_fact_rule)
-            kb.kb_add(new_fact_rule)
-
-    def _get_rule_bindings(self, fact, rule, used_terms = []):
-        bindings = None
-        # print()
-        # rhsst = str(rule.rhs)
+        best, best_estimate = None, None
         for stmt in rule.lhs:
             if not is_variable(stmt): continue
-            bindings = match(stmt, fact.statement, bindings, used_terms)
-            # if rhsst == "(bomb c03)" and bindings and len(bindings.bindings)>0:
-            #     print("matching",stmt,fact.statement, ", bindings:",bindings)
-        # if(bindings and len(bindings.bindings)>0): print("bindings:",bindings)
-        return bindings
\ No newline at end of file
+            estimate = kb.facts.estimate(stmt)
+            if best is None or estimate < best_estimate:
+                best, best_estimate = stmt, estimate
+        return best, best_estimate
+
+    def get_new_rule(self, rule, fact, bindings, kb):
+        new_lhs = [instantiate(stmt,bindings) for stmt in rule.lhs]
+        new_rhs = instantiate(rule.rhs, bindings)
+        new_rule = Rule([new_lhs,new_rhs], [])
+        for stmt in new_lhs:
+            if not is_variable(stmt) and not kb.check_facts(stmt): return False
+        return new_rule
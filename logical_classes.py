@@ -1,4 +1,20 @@
-from util import is_var
+import sys
+
+import util
+
+def justification_key(justification):
+    """Key a justification is filed under in supported_by: the keys of its
+        facts and rule. Keys are built from statements rather than the Fact and
+        Rule objects themselves, so the dicts holding them can be pickled even
+        though facts and rules refer to each other.
+
+    Args:
+        justification (tuple): facts matched against the LHS of a rule, then the rule
+
+    Returns:
+        tuple
+    """
+    return tuple(item.key for item in justification)
 
 class Fact(object):
     """Represents a fact in our knowledge base. Has a statement containing the
@@ -10,30 +26,30 @@ class Fact(object):
         statement (Statement): statement of this fact, basically what the fact actually says
         asserted (bool): boolean flag indicating if fact was asserted instead of
             inferred from other rules/facts in the KB
-        supported_by (listof Fact|Rule): Facts/Rules that allow inference of
-            the statement
-        supports_facts (listof Fact): Facts that this fact supports
-        supports_rules (listof Rule): Rules that this fact supports
+        supported_by (dictof tuple): justification key -> justification, a tuple
+            of the Facts and the Rule that allow inference of the statement. The
+            fact stays in the KB while it is asserted or has a justification.
+        supports_facts (dictof Fact): key -> Fact for the facts that this fact supports
+        supports_rules (dictof Rule): key -> Rule for the rules that this fact supports
     """
+    __slots__ = ('statement', 'asserted', 'supported_by', 'supports_facts', 'supports_rules')
+    name = "fact"
+
     def __init__(self, statement, supported_by=[]):
         """Constructor for Fact setting up useful flags and generating appropriate statement
 
         Args:
             statement (str|Statement): The statement of this fact, basically what the
                 fact actually says
-            supported_by (listof Fact|Rule): Facts/Rules that allow inference of
-                the statement
+            supported_by (listof tuple): justifications, each the Facts and Rule
+                that allow inference of the statement
         """
         super(Fact, self).__init__()
-        self.name = "fact"
         self.statement = statement if isinstance(statement, Statement) else Statement(statement)
         self.asserted = not supported_by
-        #self.supported_by = supported_by
-        self.supported_by = []
-        self.supports_facts = []
-        self.supports_rules = []
-        for pair in supported_by:
-           self.supported_by.append(pair)
+        self.supported_by = {justification_key(j): j for j in supported_by}
+        self.supports_facts = {}
+        self.supports_rules = {}
 
     def __repr__(self):
         """Define internal string representation
@@ -49,16 +65,16 @@ class Fact(object):
         string = self.name + ":\n"
         string += "\t" + str(self.statement) + "\n"
         string += "\t Asserted:       " + str(self.asserted) + "\n"
-        if self.supported_by != []:
-            name_strings = [str(x.name) for y in self.supported_by for x in y]
+        if self.supported_by:
+            name_strings = [str(x.name) for y in self.supported_by.values() for x in y]
             supported_by_str = ", ".join(name_strings)
             string += "\t Supported by:   [" + supported_by_str + "]\n"
-        if self.supports_facts != []:
-            name_strings = [str(x.name) for x in self.supports_facts]
+        if self.supports_facts:
+            name_strings = [str(x.name) for x in self.supports_facts.values()]
             supports_f_str = ", ".join(name_strings)
             string += "\t Supports facts: [" + supports_f_str + "]\n"
-        if self.supports_rules != []:
-            name_strings = [str(x.name) for x in self.supports_rules]
+        if self.supports_rules:
+            name_strings = [str(x.name) for x in self.supports_rules.values()]
             supports_r_str = ", ".join(name_strings)
             string += "\t Supports rules: [" + supports_r_str + "]\n"
         return string
@@ -68,6 +84,17 @@ class Fact(object):
         """
         return isinstance(other, Fact) and self.statement == other.statement
 
+    def __hash__(self):
+        """Facts hash like their statement
+        """
+        return hash(self.statement)
+
+    @property
+    def key(self):
+        """Key identifying this fact in support bookkeeping: its statement
+        """
+        return self.statement
+
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
@@ -85,30 +112,30 @@ class Rule(object):
         rhs (Statement): RHS statment of this rule
         asserted (bool): boolean flag indicating if rule was asserted instead of
             inferred from other rules/facts in the KB
-        supported_by (listof Fact|Rule): Facts/Rules that allow inference of
-            the statement
-        supports_facts (listof Fact): Facts that this rule supports
-        supports_rules (listof Rule): Rules that this rule supports
+        supported_by (dictof tuple): justification key -> justification, a tuple
+            of the Facts and the Rule that allow inference of the rule
+        supports_facts (dictof Fact): key -> Fact for the facts that this rule supports
+        supports_rules (dictof Rule): key -> Rule for the rules that this rule supports
     """
+    __slots__ = ('lhs', 'rhs', 'asserted', 'supported_by', 'supports_facts', 'supports_rules')
+    name = "rule"
+
     def __init__(self, rule, supported_by=[]):
         """Constructor for Rule setting up useful flags and generating appropriate LHS & RHS
 
         Args:
             rule (listof list): Raw representation of statements making up LHS and
                 RHS of this rule
-            supported_by (listof Fact|Rule): Facts/Rules that allow inference of
-                the statement
+            supported_by (listof tuple): justifications, each the Facts and Rule
+                that allow inference of the rule
         """
         super(Rule, self).__init__()
-        self.name = "rule"
         self.lhs = [statement if isinstance(statement, Statement) else Statement(statement) for statement in rule[0]]
         self.rhs = rule[1] if isinstance(rule[1], Statement) else Statement(rule[1])
         self.asserted = not supported_by
-        self.supported_by = []
-        self.supports_facts = []
-        self.supports_rules = []
-        for pair in supported_by:
-            self.supported_by.append(pair)
+        self.supported_by = {justification_key(j): j for j in supported_by}
+        self.supports_facts = {}
+        self.supports_rules = {}
 
     def __repr__(self):
         """Define internal string representation
@@ -127,16 +154,16 @@ class Rule(object):
             string += "\t\t" + str(statement) + "\n"
         string += "\t Right hand:\n\t\t" + str(self.rhs) + "\n"
         string += "\t Asserted:       " + str(self.asserted) + "\n"
-        if self.supported_by != []:
-            name_strings = [str(x.name) for y in self.supported_by for x in y ]
+        if self.supported_by:
+            name_strings = [str(x.name) for y in self.supported_by.values() for x in y]
             supported_by_str = ", ".join(name_strings)
             string += "\t Supported by:   [" + supported_by_str + "]\n"
-        if self.supports_facts != []:
-            name_strings = [str(x.name) for x in self.supports_facts]
+        if self.supports_facts:
+            name_strings = [str(x.name) for x in self.supports_facts.values()]
             supports_f_str = ", ".join(name_strings)
             string += "\t Supports facts: [" + supports_f_str + "]\n"
-        if self.supports_rules != []:
-            name_strings = [str(x.name) for x in self.supports_rules]
+        if self.supports_rules:
+            name_strings = [str(x.name) for x in self.supports_rules.values()]
             supports_r_str = ", ".join(name_strings)
             string += "\t Supports rules: [" + supports_r_str + "]\n"
         return string
@@ -147,6 +174,17 @@ class Rule(object):
         is_rule = isinstance(other, Rule)
         return is_rule and self.lhs == other.lhs and self.rhs == other.rhs
 
+    def __hash__(self):
+        """Rules hash like their LHS and RHS statements
+        """
+        return hash((tuple(self.lhs), self.rhs))
+
+    @property
+    def key(self):
+        """Key identifying this rule in support bookkeeping: its LHS and RHS
+        """
+        return (tuple(self.lhs), self.rhs)
+
     def __ne__(self, other):
         """Define behavior of != when applied to this object
         """
@@ -155,13 +193,18 @@ class Rule(object):
 class Statement(object):
     """Represents a statement in our knowledge base, e.g. (attacked Ai Nosliw),
         (diamonds Loot), (isa Sorceress Wizard), etc. These statements show up
-        in Facts or on the LHS and RHS of Rules
+        in Facts or on the LHS and RHS of Rules. Statements are immutable and
+        hashable, so they can be used as dict and set keys.
 
     Attributes:
-        terms (listof Term): List of terms (Variable or Constant) in the
+        terms (tupleof Term): Terms (Variable or Constant) in the
             statement, e.g. 'Nosliw' or '?d'
         predicate (str): The predicate of the statement, e.g. isa, hero, needs
+        var_mask (tupleof bool): for each term whether it is a Variable, worked
+            out once here so matching does not have to classify terms again
     """
+    __slots__ = ('predicate', 'terms', 'var_mask', '_hash')
+
     def __init__(self, statement_list=[]):
         """Constructor for Statements with optional list of Statements that are
             converted to appropriate terms (and one predicate)
@@ -172,35 +215,48 @@ class Statement(object):
                 the list is either instantiated Terms or strings to be passed to the
                 Term constructor
         """
-        super(Statement, self).__init__()
-        self.terms = []
-        self.predicate = ""
-
+        predicate = ""
+        terms = ()
         if statement_list:
-            self.predicate = statement_list[0]
-            self.terms = [t if isinstance(t, Term) else Term(t) for t in statement_list[1:]]
+            predicate = sys.intern(statement_list[0])
+            terms = tuple([t if t.__class__ is Term else Term(t) for t in statement_list[1:]])
+        object.__setattr__(self, 'predicate', predicate)
+        object.__setattr__(self, 'terms', terms)
+        object.__setattr__(self, 'var_mask', tuple([t.term.__class__ is Variable for t in terms]))
+        object.__setattr__(self, '_hash', hash((predicate, terms)))
+
+    def __setattr__(self, name, value):
+        """Statements are immutable
+        """
+        raise AttributeError("Statement is immutable")
+
+    def __reduce__(self):
+        """Rebuild through the constructor so terms are re-interned when unpickled
+        """
+        return (Statement, ([self.predicate] + list(self.terms),))
 
     def __repr__(self):
         """Define internal string representation
         """
-        return 'Statement({!r}, {!r})'.format(self.predicate, self.terms)
+        return 'Statement({!r}, {!r})'.format(self.predicate, list(self.terms))
 
     def __str__(self):
         """Define external representation when printed
         """
         return "(" + self.predicate + " " + ' '.join((str(t) for t in self.terms)) + ")"
 
+    def __hash__(self):
+        """Hash of the predicate and terms, computed once at construction
+        """
+        return self._hash
+
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        if self.predicate != other.predicate:
-            return False
-
-        for self_term, other_term in zip(self.terms, other.terms):
-            if self_term != other_term:
-                return False
-
-        return True
+        return self is other or (isinstance(other, Statement)
+            and self._hash == other._hash
+            and self.predicate == other.predicate
+            and self.terms == other.terms)
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
@@ -210,21 +266,42 @@ class Statement(object):
 class Term(object):
     """Represents a term (a Variable or Constant) in our knowledge base. Can
         sorta be thought of as a super class of Variable and Constant, though
-        there is no inheritance implemented in the code.
+        there is no inheritance implemented in the code. Terms are interned, so
+        there is exactly one Term per element and terms compare by identity.
 
     Attributes:
         term (Variable|Constant): The Variable or Constant that this term holds (represents)
     """
-    def __init__(self, term):
-        """Constructor for Term which converts term to appropriate form
+    __slots__ = ('term', '_hash')
+    _interned = {}
+
+    def __new__(cls, term):
+        """Get the interned Term for term, creating it on first use
 
         Args:
-            term (Variable|Constant|string): Either an instantiated Variable or
+            term (Variable|Constant|Term|string): Either an instantiated Variable or
                 Constant, or a string to be passed to the appropriate constructor
         """
-        super(Term, self).__init__()
-        is_var_or_const = isinstance(term, Variable) or isinstance(term, Constant)
-        self.term = term if is_var_or_const else (Variable(term) if is_var(term) else Constant(term))
+        if isinstance(term, Term): return term
+        element = term.element if isinstance(term, (Variable, Constant)) else term
+        self = cls._interned.get(element)
+        if self is None:
+            self = object.__new__(cls)
+            symbol = Variable(element) if util.is_var(element) else Constant(element)
+            object.__setattr__(self, 'term', symbol)
+            object.__setattr__(self, '_hash', symbol._hash)
+            cls._interned[symbol.element] = self
+        return self
+
+    def __setattr__(self, name, value):
+        """Terms are immutable
+        """
+        raise AttributeError("Term is immutable")
+
+    def __reduce__(self):
+        """Re-intern when unpickled or copied
+        """
+        return (Term, (self.term.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -234,15 +311,17 @@ class Term(object):
     def __str__(self):
         """Define external representation when printed
         """
-        return str(self.term)
+        return self.term.element
+
+    def __hash__(self):
+        """Hash of the element, shared with the wrapped Variable or Constant
+        """
+        return self._hash
 
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
-            or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+        return self is other or self.term is other
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
@@ -250,19 +329,42 @@ class Term(object):
         return not self == other
 
 class Variable(object):
-    """Represents a variable used in statements
+    """Represents a variable used in statements. Variables are interned, so
+        Variable('?x') is Variable('?x').
 
     Attributes:
         element (str): The name of the variable, e.g. '?x'
+        slot (int): index of the variable's value in Bindings, assigned in the
+            order variables are first created
     """
-    def __init__(self, element):
-        """Constructor for Variable
+    __slots__ = ('element', 'slot', '_hash')
+    _interned = {}
+
+    def __new__(cls, element):
+        """Get the interned Variable for element, creating it on first use
 
         Args:
             element (str): The name of the variable, e.g. '?x'
         """
-        super(Variable, self).__init__()
-        self.element = element
+        self = cls._interned.get(element)
+        if self is None:
+            self = object.__new__(cls)
+            element = sys.intern(element)
+            object.__setattr__(self, 'element', element)
+            object.__setattr__(self, 'slot', len(cls._interned))
+            object.__setattr__(self, '_hash', hash(element))
+            cls._interned[element] = self
+        return self
+
+    def __setattr__(self, name, value):
+        """Variables are immutable
+        """
+        raise AttributeError("Variable is immutable")
+
+    def __reduce__(self):
+        """Re-intern when unpickled or copied
+        """
+        return (Variable, (self.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -272,15 +374,17 @@ class Variable(object):
     def __str__(self):
         """Define external representation when printed
         """
-        return str(self.element)
+        return self.element
+
+    def __hash__(self):
+        """Hash of the element
+        """
+        return self._hash
 
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
-            or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+        return self is other or (isinstance(other, Term) and other.term is self)
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
@@ -288,19 +392,39 @@ class Variable(object):
         return not self == other
 
 class Constant(object):
-    """Represents a constant used in statements
+    """Represents a constant used in statements. Constants are interned, so
+        Constant('Nosliw') is Constant('Nosliw').
 
     Attributes:
         element (str): The value of the constant, e.g. 'Nosliw'
     """
-    def __init__(self, element):
-        """Constructor for Constant
+    __slots__ = ('element', '_hash')
+    _interned = {}
+
+    def __new__(cls, element):
+        """Get the interned Constant for element, creating it on first use
 
         Args:
             element (str): The value of the constant, e.g. 'Nosliw'
         """
-        super(Constant, self).__init__()
-        self.element = element
+        self = cls._interned.get(element)
+        if self is None:
+            self = object.__new__(cls)
+            element = sys.intern(element)
+            object.__setattr__(self, 'element', element)
+            object.__setattr__(self, '_hash', hash(element))
+            cls._interned[element] = self
+        return self
+
+    def __setattr__(self, name, value):
+        """Constants are immutable
+        """
+        raise AttributeError("Constant is immutable")
+
+    def __reduce__(self):
+        """Re-intern when unpickled or copied
+        """
+        return (Constant, (self.element,))
 
     def __repr__(self):
         """Define internal string representation
@@ -310,15 +434,17 @@ class Constant(object):
     def __str__(self):
         """Define external representation when printed
         """
-        return str(self.element)
+        return self.element
+
+    def __hash__(self):
+        """Hash of the element
+        """
+        return self._hash
 
     def __eq__(self, other):
         """Define behavior of == when applied to this object
         """
-        return (self is other
-            or isinstance(other, Term) and self.term.element == other.term.element
-            or ((isinstance(other, Variable) or isinstance(other, Constant))
-                and self.term.element == other.element))
+        return self is other or (isinstance(other, Term) and other.term is self)
 
     def __ne__(self, other):
         """Define behavior of != when applied to this object
@@ -355,19 +481,29 @@ class Binding(object):
         return self.variable.element.upper() + " : " + self.constant.element
 
 class Bindings(object):
-    """Represents Binding(s) used while matching two statements
+    """Represents Binding(s) used while matching two statements. Values are kept
+        in a flat list indexed by Variable.slot, so binding and looking up a
+        variable is a list access that returns the interned Term without
+        allocating. The list starts empty and only grows up to the highest
+        slot bound, so its size does not depend on how many variables have
+        been interned. The trail records the variables in the order they were
+        bound, which lets a caller undo back to an earlier point.
 
     Attributes:
-        bindings (listof Bindings): bindings involved in match
-        bindings_dict (dictof Bindings): bindings involved in match where key is
-            bound variable and value is bound value,
+        values (listof Term|None): slot -> bound value
+        trail (listof Variable): bound variables in the order they were bound
+        bindings (listof Binding): bindings involved in match, built on access
+        bindings_dict (dictof str): bindings involved in match where key is
+            bound variable and value is bound value, built on access,
             e.g. some_bindings.bindings_dict['?d'] => 'Nosliw'
     """
+    __slots__ = ('values', 'trail')
+
     def __init__(self):
         """Constructor for Bindings creating initially empty instance
         """
-        self.bindings = []
-        self.bindings_dict = {}
+        self.values = []
+        self.trail = []
 
     def __repr__(self):
         """Define internal string representation
@@ -377,7 +513,7 @@ class Bindings(object):
     def __str__(self):
         """Define external representation when printed
         """
-        if self.bindings == []:
+        if not self.trail:
             return "No bindings"
         return ", ".join((str(binding) for binding in self.bindings))
 
@@ -386,19 +522,56 @@ class Bindings(object):
             random_bindings.bindings_dict[key] when the dictionary is not empty
             and the key exists, otherwise None
         """
-        return (self.bindings_dict[key] 
-                if (self.bindings_dict and key in self.bindings_dict)
-                else None)
+        variable = Variable._interned.get(key)
+        value = self.value_of(variable) if variable is not None else None
+        return value.term.element if value is not None else None
+
+    def __getstate__(self):
+        """Pickle as (variable, value) names, slots differ between processes
+        """
+        return [(v.element, self.values[v.slot].term.element) for v in self.trail]
+
+    def __setstate__(self, state):
+        """Rebind the pickled (variable, value) names
+        """
+        Bindings.__init__(self)
+        for variable, value in state:
+            self.add_binding(Variable(variable), Term(value).term)
+
+    @property
+    def bindings(self):
+        return [Binding(v, self.values[v.slot].term) for v in self.trail]
+
+    @property
+    def bindings_dict(self):
+        return {v.element: self.values[v.slot].term.element for v in self.trail}
+
+    def elements(self):
+        """Names of the bound values, in the order they were bound
+        """
+        return [self.values[v.slot].term.element for v in self.trail]
 
     def add_binding(self, variable, value):
         """Add a binding from a variable to a value
 
         Args:
             variable (Variable): the variable to bind to
-            value (Constant): the value to bind to the variable
+            value (Variable|Constant|Term): the value to bind to the variable
         """
-        self.bindings_dict[variable.element] = value.element
-        self.bindings.append(Binding(variable, value))
+        slot = variable.slot
+        if slot >= len(self.values):
+            self.values.extend([None] * (slot + 1 - len(self.values)))
+        self.values[slot] = value if value.__class__ is Term else Term(value)
+        self.trail.append(variable)
+
+    def value_of(self, variable):
+        """Interned Term bound to variable, None if it is not bound
+
+        Args:
+            variable (Variable): variable to look up
+        """
+        slot = variable.slot
+        return self.values[slot] if slot < len(self.values) else None
 
     def bound_to(self, variable):
         """Check if variable is bound. If so return value bound to it, else False.
@@ -409,12 +582,8 @@ class Bindings(object):
         Returns:
             Variable|Constant|False: returns bound term if variable is bound else False
         """
-        if variable.element in self.bindings_dict.keys():
-            value = self.bindings_dict[variable.element]
-            if value:
-                return Variable(value) if is_var(value) else Constant(value)
-
-        return False
+        value = self.value_of(variable)
+        return value.term if value is not None else False
 
     def test_and_bind(self, variable_term, value_term):
         """Check if variable_term already bound. If so return whether or not passed
@@ -429,13 +598,42 @@ class Bindings(object):
             bool: if variable bound returns whether or not bound value matches value_term,
                 else True
         """
-        bound = self.bound_to(variable_term.term)
-        if bound:
-            return value_term.term == bound
-            
-        self.add_binding(variable_term.term, value_term.term)
+        variable = variable_term.term
+        slot = variable.slot
+        values = self.values
+        if slot < len(values):
+            bound = values[slot]
+            if bound is not None: return bound is value_term
+            values[slot] = value_term
+        else:
+            values.extend([None] * (slot - len(values)))
+            values.append(value_term)
+        self.trail.append(variable)
         return True
 
+    def mark(self):
+        """Position in the trail to undo back to
+        """
+        return len(self.trail)
+
+    def undo(self, mark):
+        """Unbind the variables bound since mark was taken
+
+        Args:
+            mark (int): value returned by mark
+        """
+        trail, values = self.trail, self.values
+        while len(trail) > mark:
+            values[trail.pop().slot] = None
+
+    def copy(self):
+        """Independent copy that can be extended without affecting this one
+        """
+        new = Bindings.__new__(Bindings)
+        new.values = self.values.copy()
+        new.trail = self.trail.copy()
+        return new
+
 
 class ListOfBindings(object):
     """Container for multiple Bindings
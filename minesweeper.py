@@ -1,17 +1,37 @@
 """A command line version of Minesweeper"""
+import functools
 import random
 import re
+import sys
 import time
+import weakref
 from string import ascii_lowercase
 
 from knowledgebase import KnowledgeBase
-import read
+from logical_classes import Statement
+import snapshot
+from util import printv
 
+try:
+    import board
+except ImportError:  # NumPy is optional, the list-of-lists code below is the fallback
+    board = None
 
-def setupgrid(gridsize, start, numberofmines):
+verbose = 1
+
+RULES_FILE = 'minesweeper_kb.txt'
+SNAPSHOT_DIR = '.kb_cache'
+
+# What updateKB last told each KB about the board, see BoardSync
+_synced = weakref.WeakKeyDictionary()
+# Cells each KB has decided or failed to decide, see DecisionCache
+_decisions = weakref.WeakKeyDictionary()
+
+
+def setupgrid(gridsize, start, numberofmines, rng=random):
     emptygrid = [['0' for i in range(gridsize)] for i in range(gridsize)]
 
-    mines = getmines(emptygrid, start, numberofmines)
+    mines = getmines(emptygrid, start, numberofmines, rng)
 
     for i, j in mines:
         emptygrid[i][j] = 'X'
@@ -23,20 +43,21 @@ def setupgrid(gridsize, start, numberofmines):
 
 def showgrid(grid):
     gridsize = len(grid)
+    width = max(2, len(str(gridsize)))
 
-    horizontal = '   ' + (4 * gridsize * '-') + '-'
+    horizontal = ' ' * (width + 1) + (4 * gridsize * '-') + '-'
 
     # Print top column letters
-    toplabel = '     '
+    toplabel = ' ' * (width + 3)
 
-    for i in ascii_lowercase[:gridsize]:
-        toplabel = toplabel + i + '   '
+    for j in range(gridsize):
+        toplabel = toplabel + column_label(j).ljust(4)
 
     print(toplabel + '\n' + horizontal)
 
     # Print left row numbers
     for idx, i in enumerate(grid):
-        row = '{0:2} |'.format(idx + 1)
+        row = '{0:{1}} |'.format(idx + 1, width)
 
         for j in i:
             row = row + ' ' + j + ' |'
@@ -46,11 +67,11 @@ def showgrid(grid):
     print('')
 
 
-def getrandomcell(grid):
+def getrandomcell(grid, rng=random):
     gridsize = len(grid)
 
-    a = random.randint(0, gridsize - 1)
-    b = random.randint(0, gridsize - 1)
+    a = rng.randint(0, gridsize - 1)
+    b = rng.randint(0, gridsize - 1)
 
     return (a, b)
 
@@ -69,21 +90,28 @@ def getneighbors(grid, rowno, colno):
     return neighbors
 
 
-def getmines(grid, start, numberofmines):
+def getmines(grid, start, numberofmines, rng=random):
     mines = []
     # return [(4, 6), (3, 7), (6, 4), (2, 0), (3, 5), (3, 3), (6, 2), (7, 2), (0, 2), (2, 3)]     #Winnable
     neighbors = getneighbors(grid, *start)
 
     for i in range(numberofmines):
-        cell = getrandomcell(grid)
+        cell = getrandomcell(grid, rng)
         while cell == start or cell in mines or cell in neighbors:
-            cell = getrandomcell(grid)
+            cell = getrandomcell(grid, rng)
         mines.append(cell)
-    print("mines",mines)
+    printv("mines {}", 0, verbose, [mines])
     return mines
 
 
 def getnumbers(grid):
+    if board is not None:
+        b = board.Board.from_grid(grid)
+        numbers = b.numbers().astype('U1')
+        numbers[b.mines] = 'X'
+        grid[:] = numbers.tolist()
+        return grid
+
     for rowno, row in enumerate(grid):
         for colno, cell in enumerate(row):
             if cell != 'X':
@@ -98,19 +126,28 @@ def getnumbers(grid):
 
 
 def showcells(grid, currgrid, rowno, colno):
-    # Exit function if the cell was already shown
+    # Show the cell and flood-fill out from cells with no neighboring mines.
+    # Uses an explicit stack so huge empty regions do not hit the recursion
+    # limit, and shows cells as they are queued so each is visited once.
+    # Returns the set of cells that were revealed.
     if currgrid[rowno][colno] != ' ':
-        return
-
-    # Show current cell
+        return set()
+    gridsize = len(grid)
     currgrid[rowno][colno] = grid[rowno][colno]
-
-    # Get the neighbors if the cell is empty
-    if grid[rowno][colno] == '0':
-        for r, c in getneighbors(grid, rowno, colno):
-            # Repeat function for each neighbor that doesn't have a flag
-            if currgrid[r][c] != 'F':
-                showcells(grid, currgrid, r, c)
+    revealed = {(rowno, colno)}
+    stack = [(rowno, colno)] if grid[rowno][colno] == '0' else []
+    while stack:
+        r, c = stack.pop()
+        for i in range(max(r - 1, 0), min(r + 2, gridsize)):
+            row, solution = currgrid[i], grid[i]
+            for j in range(max(c - 1, 0), min(c + 2, gridsize)):
+                # Show hidden neighbors, skipping flags, and expand the empty ones
+                if row[j] == ' ':
+                    row[j] = solution[j]
+                    revealed.add((i, j))
+                    if solution[j] == '0':
+                        stack.append((i, j))
+    return revealed
 
 
 def playagain():
@@ -124,7 +161,7 @@ def parseinput(inputstring, gridsize, helpmessage):
     flag = False
     message = "Invalid cell. " + helpmessage
 
-    pattern = r'([a-{}])([0-9]+)(f?)'.format(ascii_lowercase[gridsize - 1])
+    pattern = r'([a-z]+)([0-9]+)(f?)'
     validinput = re.match(pattern, inputstring)
 
     if inputstring == 'help':
@@ -132,55 +169,234 @@ def parseinput(inputstring, gridsize, helpmessage):
 
     elif validinput:
         rowno = int(validinput.group(2)) - 1
-        colno = ascii_lowercase.index(validinput.group(1))
+        colno = column_index(validinput.group(1))
         flag = bool(validinput.group(3))
 
-        if -1 < rowno < gridsize:
+        if -1 < rowno < gridsize and colno < gridsize:
             cell = (rowno, colno)
             message = ''
 
     return {'cell': cell, 'flag': flag, 'message': message}
 
+def column_label(colno):
+    # Spreadsheet-style label of a column: a..z, then aa, ab, ..., zz, aaa, ...
+    label = ''
+    colno += 1
+    while colno:
+        colno, rem = divmod(colno - 1, 26)
+        label = ascii_lowercase[rem] + label
+    return label
+
+def column_index(label):
+    # Column number of a label made by column_label
+    colno = 0
+    for letter in label:
+        colno = colno * 26 + ascii_lowercase.index(letter) + 1
+    return colno - 1
+
+@functools.lru_cache(maxsize=None)
+def cellid(i, j):
+    # Name of the KB constant for the cell at row i, column j, e.g. c3_11.
+    # The separator keeps (1, 11) and (11, 1) apart, including the -1 and
+    # gridsize border rows. Names are cached so each is built and interned once.
+    return sys.intern(f'c{i}_{j}')
+
+def cellcoords(name):
+    # Row and column of the cell named by cellid, e.g. c3_11 -> (3, 11)
+    i, j = name[1:].split('_')
+    return int(i), int(j)
+
+def as_board(grid):
+    # Array-backed copy of a list-of-lists grid, or the grid if it already is one
+    return grid if isinstance(grid, board.Board) else board.Board.from_grid(grid)
+
+def is_board(grid):
+    # Whether grid is a board.Board rather than a list-of-lists grid
+    return board is not None and isinstance(grid, board.Board)
+
 def neighbors_equal(grid, i, j, equal_to):
     if isinstance(equal_to, str): equal_to = {equal_to}
     return [grid[a][b] in equal_to for a, b in getneighbors(grid, i, j)]
 
-def init_kb(gridsize):
+def init_kb(gridsize, snapshot_dir=SNAPSHOT_DIR, mode='rete'):
+    # Reuse the compiled KB for this rules file, grid size and mode if there is one
+    if snapshot_dir:
+        key = snapshot.snapshot_key(RULES_FILE, gridsize, mode)
+        path = snapshot.snapshot_path(snapshot_dir, gridsize, key)
+        KB = snapshot.load(path, key)
+        if KB is not None: return KB
+
     # Using rules from 
-    KB = KnowledgeBase([], [], 'minesweeper_kb.txt')
-    print("Initializing KB")
+    KB = KnowledgeBase([], [], RULES_FILE, mode)
+    printv("Initializing KB", 0, verbose)
     start, end = -1, gridsize+1
     # print(start,end)
+    facts = []
     for i in range(start,end):
         for j in range(start,end):
             if i==start or i==end-1 or j==start or j==end-1:
-                KB.kb_add_parse(f'fact: (safe c{i}{j})')
+                facts.append(('safe', cellid(i, j)))
             for k in range(max(i-1,start),min(i+2,end)):
                 for l in range(max(j-1, start), min(j+2, end)):
                     if i==k and j==l: continue
-                    KB.kb_add_parse(f'fact: (nextTo c{i}{j} c{k}{l})')
-                    KB.kb_add_parse(f'fact: (nextTo c{k}{l} c{i}{j})')
+                    facts.append(('nextTo', cellid(i, j), cellid(k, l)))
+                    facts.append(('nextTo', cellid(k, l), cellid(i, j)))
+    KB.assert_facts(facts)
+    if snapshot_dir: snapshot.save(KB, path, key)
     return KB
 
 
-def updateKB(grid, KB):
-    # Pass facts to the KB
-    for i, row in enumerate(grid):
-        for j, ele in enumerate(row):
-            if ele != ' ' and ele != 'F':
-                KB.kb_add_parse(f'fact: (safe c{i}{j})')
-                if ele != '0':
-                    near_n_bombs = sum(neighbors_equal(grid, i, j, "F"))
-                    near_n_safe = 8 - sum(neighbors_equal(grid, i, j, {"F"," "}))
-                    KB.kb_add_parse(f'fact: (near{ele}bomb c{i}{j})')
-                    KB.kb_add_parse(f'fact: (known{near_n_bombs}bomb c{i}{j})')
-                    KB.kb_add_parse(f'fact: (known{near_n_safe}safe c{i}{j})')
+class BoardSync(object):
+    """What updateKB has told a KB about the board so far
+
+    Attributes:
+        grid (listof list|board.Board): copy of the board as of the last update,
+            a Board if the updates are Boards
+        counts (dictof tuple): cell -> (knownNbomb, knownNsafe) predicates currently
+            asserted for that cell
+    """
+    def __init__(self, grid):
+        if is_board(grid):
+            self.grid = board.Board.hidden(len(grid))
+        else:
+            self.grid = [[' ' for i in range(len(grid))] for i in range(len(grid))]
+        self.counts = {}
+
+    def changed(self, grid):
+        # Cells of grid that differ from the copy
+        if is_board(self.grid): return as_board(grid).changed(self.grid)
+        return [(i, j) for i, row in enumerate(grid) if row != self.grid[i]
+                for j, ele in enumerate(row) if ele != self.grid[i][j]]
+
+    def shown(self, cells):
+        # Characters the copy shows in cells
+        if is_board(self.grid): return self.grid.chars(cells)
+        return [self.grid[i][j] for i, j in cells]
+
+    def update(self, grid, cells):
+        # Copy cells of grid into the copy
+        if is_board(self.grid):
+            self.grid.update(as_board(grid), cells)
+            return
+        for i, j in cells:
+            self.grid[i][j] = grid[i][j]
+
+class DecisionCache(object):
+    """What a KB has concluded about cells, kept across turns so proven moves
+        are served without asking again. The cache listens to the KB's (safe c)
+        and (bomb c) facts, so it follows every conclusion as it is derived
+        and forgets it when retraction takes its support away.
+
+        A conclusion about a cell only uses facts about the cell's neighbors,
+        and those only change when a cell within two steps of it changes, so a
+        cell the KB could not decide is not asked about again until then.
+
+    Attributes:
+        safe (dictof None): cells proven safe, in the order they were proven
+        bombs (dictof None): cells proven to be mines, in the order they were proven
+        undecided (set): cells asked about with no answer whose neighborhood has
+            not changed since
+    """
+    def __init__(self, kb):
+        self.safe = {}
+        self.bombs = {}
+        self.undecided = set()
+        for predicate, cells in (('safe', self.safe), ('bomb', self.bombs)):
+            for fact in kb.facts.candidates(Statement((predicate, '?c'))):
+                cells[cellcoords(fact.statement.terms[0].term.element)] = None
+            kb.listen(predicate, self.on_fact)
+
+    def on_fact(self, fact, added):
+        # Follow a (safe c) or (bomb c) fact entering or leaving the KB
+        cells = self.safe if fact.statement.predicate == 'safe' else self.bombs
+        cell = cellcoords(fact.statement.terms[0].term.element)
+        if added: cells[cell] = None
+        else: cells.pop(cell, None)
+
+    def next_move(self, grid):
+        # The first proven cell that is still hidden, safe cells before mines,
+        # dropping cells that have been revealed or flagged since
+        rows, cols = grid.shape if is_board(grid) else (len(grid), len(grid[0]) if grid else 0)
+        for cells, isBomb in ((self.safe, False), (self.bombs, True)):
+            for cell in list(cells):
+                i, j = cell
+                if 0 <= i < rows and 0 <= j < cols and (
+                        grid.state[i, j] == board.HIDDEN if is_board(grid) else grid[i][j] == ' '):
+                    return cell, isBomb
+                del cells[cell]
+        return None
+
+    def touched(self, changed):
+        # Cells within two steps of changed cells may be decidable now
+        for i, j in changed:
+            for a in range(i - 2, i + 3):
+                for b in range(j - 2, j + 3):
+                    self.undecided.discard((a, b))
+
+def decisions(kb):
+    # The DecisionCache of kb, created on first use
+    cache = _decisions.get(kb)
+    if cache is None: cache = _decisions[kb] = DecisionCache(kb)
+    return cache
+
+def neighbor_counts(grid, cells):
+    # (flagged, flagged or hidden) neighbor counts of each of cells. Both
+    # paths only read the neighbors of cells.
+    if is_board(grid):
+        flags = grid.flag_counts(cells)
+        return list(zip(flags.tolist(), (flags + grid.unknown_counts(cells)).tolist()))
+    return [(sum(neighbors_equal(grid, i, j, "F")), sum(neighbors_equal(grid, i, j, {"F", " "})))
+            for i, j in cells]
+
+def updateKB(grid, KB, changed=None):
+    # Pass facts about what changed since the last update to the KB. Only
+    # changed cells and their neighbors (whose known counts depend on them)
+    # are looked at, and count facts that no longer hold are retracted.
+    # changed, e.g. the cells returned by showcells plus any flags placed,
+    # saves diffing the whole grid against the last update. A list grid is
+    # read as is, converting it to a Board would cost a pass over the board.
+    sync = _synced.get(KB)
+    if sync is None:
+        sync = _synced[KB] = BoardSync(grid)
+    changed = sync.changed(grid) if changed is None else list(changed)
+    affected = set(changed)
+    for i, j in changed:
+        affected.update(getneighbors(grid, i, j))
+    affected = sorted(affected)
+    shown = grid.chars(affected) if is_board(grid) else [grid[i][j] for i, j in affected]
+
+    facts = []
+    retract = []
+    counted = []
+    for (i, j), ele, old_ele in zip(affected, shown, sync.shown(affected)):
+        if ele == ' ' or ele == 'F': continue
+        cell = cellid(i, j)
+        if old_ele != ele:
+            facts.append(('safe', cell))
+            if ele != '0': facts.append((f'near{ele}bomb', cell))
+        if ele != '0': counted.append((i, j))
+    for (i, j), (flags, covered) in zip(counted, neighbor_counts(grid, counted)):
+        cell = cellid(i, j)
+        known = (f'known{flags}bomb', f'known{8 - covered}safe')
+        old = sync.counts.get((i, j), ())
+        if old == known: continue
+        retract.extend((pred, cell) for pred in old if pred not in known)
+        facts.extend((pred, cell) for pred in known if pred not in old)
+        sync.counts[(i, j)] = known
+    sync.update(grid, changed)
+    cache = _decisions.get(KB)
+    if cache is not None: cache.touched(changed)
+
+    for fact in retract:
+        KB.retract_fact(*fact)
+    KB.assert_facts(facts)
     return KB
 
 
 def findFrontier(grid):
     # Get all the positions which are next to a known quantity
     # These will be the things we theorize about
+    if board is not None: return as_board(grid).frontier()
     frontier = set()
     for i, row in enumerate(grid):
         for j, ele in enumerate(row):
@@ -192,25 +408,25 @@ def findFrontier(grid):
 #Deduces a safe cell from frontier cells, if possible
 #If no safe cell found, returns null
 def deduceSafeCell(kb, grid):
+    cache = decisions(kb)
+    kb.infer()
+    # Cells proven on earlier turns, or by forward chaining since, need no asks
+    move = cache.next_move(grid)
+    if move is not None: return move
+    # A saturated KB already has every conclusion as a fact
+    if kb.mode == 'seminaive': return None,False
+
     frontierCells = findFrontier(grid)
 
     # print(frontierCells)
-    print("thinking...")
+    printv("thinking...", 0, verbose)
     if frontierCells:
         for cell in frontierCells:
-            cellid = "c"+str(cell[0])+str(cell[1])
-
-            ask = read.parse_input("fact: (bomb "+cellid+")")
-            # print("asking " + str(ask))
-            is_entailed = kb.kb_ask(ask)
-            # print("entailed:", is_entailed)
-            if is_entailed: return cell,True
-
-            ask = read.parse_input("fact: (safe "+cellid+")")
-            # print("asking " + str(ask))
-            is_entailed = kb.kb_ask(ask)
-            # print("entailed:", is_entailed)
-            if is_entailed: return cell,False
+            if cell in cache.undecided: continue
+            name = cellid(*cell)
+            if kb.ask('bomb', name): return cell,True
+            if kb.ask('safe', name): return cell,False
+            cache.undecided.add(cell)
     return None,False
 
 def playgame():
@@ -232,6 +448,7 @@ def playgame():
     print(helpmessage + " Type 'help' to show this message again.\n")
 
     while True:
+        changed = set()
         print("finding safe cell")
         predCell, isBomb = deduceSafeCell(kb, currgrid)
         print("done finding safe cell")
@@ -239,7 +456,7 @@ def playgame():
         if predCell:
             predRow, predCol = predCell
             predRow += 1
-            predCol = ascii_lowercase[predCol]
+            predCol = column_label(predCol)
             pred = predCol+str(predRow)+("f" if isBomb else "")
             print("The KB suggests the following cell: {0}".format(pred))
             minesleft = numberofmines - len(flags)
@@ -269,10 +486,12 @@ def playgame():
                 if currcell == ' ':
                     currgrid[rowno][colno] = 'F'
                     flags.append(cell)
+                    changed.add(cell)
                 # Remove the flag if there is one
                 elif currcell == 'F':
                     currgrid[rowno][colno] = ' '
                     flags.remove(cell)
+                    changed.add(cell)
                 else:
                     message = 'Cannot put a flag there'
 
@@ -288,7 +507,7 @@ def playgame():
                 return
 
             elif currcell == ' ':
-                showcells(grid, currgrid, rowno, colno)
+                changed |= showcells(grid, currgrid, rowno, colno)
 
             else:
                 message = "That cell is already shown"
@@ -304,9 +523,10 @@ def playgame():
                     playgame()
                 return
         print("updating....")
-        updateKB(currgrid, kb)
+        updateKB(currgrid, kb, changed)
         print("updating done")
         showgrid(currgrid)
         print(message)
 
-playgame()
+if __name__ == '__main__':
+    playgame()
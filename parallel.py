@@ -0,0 +1,252 @@
+"""Parallel evaluation of the frontier queries made by deduceSafeCell.
+
+Every (bomb c)/(safe c) ask is independent and only reads the KB, apart from
+caching what backward chaining derives. A ParallelDeducer starts a set of
+worker processes with a copy of the KB once per game and keeps them for every
+turn after that. Each turn the workers are only sent the board cells that
+changed since the last turn, which they feed to updateKB on their own copy, so
+their KBs, tables and decision caches carry over between turns just like the
+parent's. The frontier is split between the workers and the facts they derive
+are merged back into the parent KB.
+"""
+import multiprocessing
+import os
+
+import minesweeper as ms
+from logical_classes import Rule
+
+def _ask_cells(kb, cells, first):
+    """Ask about cells the way deduceSafeCell does
+
+    Args:
+        kb (KnowledgeBase): knowledge base to ask
+        cells (listof (int, int)): frontier cells to ask about
+        first (bool): stop at the first cell with a decisive answer
+
+    Returns:
+        (listof ((int, int), bool), listof (int, int)): (cell, isBomb) for every
+            decided cell, and the cells asked about that could not be decided
+    """
+    decisions, undecided = [], []
+    for cell in cells:
+        name = ms.cellid(*cell)
+        if kb.ask('bomb', name): decisions.append((cell, True))
+        elif kb.ask('safe', name): decisions.append((cell, False))
+        else:
+            undecided.append(cell)
+            continue
+        if first: break
+    return decisions, undecided
+
+def _supports(facts):
+    """Derived facts as picklable (statement, supports) pairs where each
+        support is the statements of the matched facts and the (lhs, rhs) of
+        the rule
+    """
+    return [(fact.statement,
+             [(tuple(item.statement for item in support[:-1]),
+               (tuple(support[-1].lhs), support[-1].rhs)) for support in fact.supported_by.values()])
+            for fact in facts if fact.supported_by]
+
+def _serve(conn, kb, grid):
+    # Worker process: keep kb in step with the board and answer asks until
+    # the parent sends None
+    grid = [list(row) for row in grid]
+    ms.updateKB(grid, kb)
+    derived = {}
+    def on_fact(fact, added):
+        if added: derived[fact.statement] = fact
+        else: derived.pop(fact.statement, None)
+    for predicate in {rule.rhs.predicate for rule in kb.rules}:
+        kb.listen(predicate, on_fact)
+    while True:
+        message = conn.recv()
+        if message is None: break
+        changes, cells, first = message
+        for i, j, ele in changes: grid[i][j] = ele
+        ms.updateKB(grid, kb, [(i, j) for i, j, ele in changes])
+        # the parent derives whatever the update itself entails
+        derived.clear()
+        decisions, undecided = _ask_cells(kb, cells, first)
+        conn.send((decisions, undecided, _supports(derived.values())))
+        derived.clear()
+    conn.close()
+
+def merge_derived(kb, derived):
+    """Add facts derived in a worker to kb with their support rebuilt from the
+        facts and rules in kb. Supports whose facts or rule kb does not have are
+        dropped.
+
+    Args:
+        kb (KnowledgeBase): knowledge base to merge into
+        derived (list): (statement, supports) pairs from a worker
+    """
+    for statement, supports in derived:
+        justified = []
+        for statements, (lhs, rhs) in supports:
+            rule = kb.rules.get(Rule([list(lhs), rhs]))
+            token = tuple(kb.facts.get(stmt) for stmt in statements)
+            if rule is not None and None not in token:
+                justified.append((statement, token + (rule,)))
+        if justified: kb._kb_add_derived(justified)
+
+def _context():
+    # fork lets workers share the parent's KB copy-on-write instead of each
+    # unpickling its own copy
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+class ParallelDeducer(object):
+    """deduceSafeCell with the frontier split across worker processes that are
+        kept for the whole game
+
+    Attributes:
+        workers (int): number of worker processes
+        min_frontier (int): frontiers with fewer cells left to ask about than
+            this are asked about serially, where the round trip to the workers
+            would cost more than it saves
+        kb (KnowledgeBase|None): knowledge base the workers were started with
+        grid (listof list|None): board as the workers were last told about it
+    """
+    def __init__(self, workers=None, min_frontier=32):
+        """Constructor for ParallelDeducer
+
+        Args:
+            workers (int|None): number of processes, default os.cpu_count()
+            min_frontier (int): smallest frontier to ask about in parallel
+        """
+        super(ParallelDeducer, self).__init__()
+        self.workers = workers or os.cpu_count() or 1
+        self.min_frontier = min_frontier
+        self.kb = None
+        self.grid = None
+        self._processes = []
+        self._connections = []
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'ParallelDeducer({!r}, {!r})'.format(self.workers, self.min_frontier)
+
+    def start(self, kb, grid):
+        """Start workers with copies of kb as updated with grid, stopping any
+            workers started for another KB
+        """
+        self.close()
+        context = _context()
+        self.kb = kb
+        self.grid = [list(row) for row in grid]
+        for _ in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(child, kb, self.grid), daemon=True)
+            process.start()
+            child.close()
+            self._processes.append(process)
+            self._connections.append(parent)
+
+    def close(self):
+        """Stop the workers"""
+        for conn in self._connections:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join()
+        self._processes, self._connections = [], []
+        self.kb = self.grid = None
+
+    def _changes(self, grid):
+        # Cells of grid that changed since the workers were last told, with
+        # what they show now
+        changes = [(i, j, ele) for i, row in enumerate(grid) if row != self.grid[i]
+                   for j, ele in enumerate(row) if ele != self.grid[i][j]]
+        for i, j, ele in changes: self.grid[i][j] = ele
+        return changes
+
+    def ask(self, kb, cells, grid, first):
+        """Ask about cells, across the workers if there are enough of them
+
+        Returns:
+            listof ((int, int), bool): (cell, isBomb) for every decided cell
+                found, at most one per worker if first
+        """
+        if len(cells) < self.min_frontier:
+            decisions, undecided = _ask_cells(kb, cells, first)
+        else:
+            if self.kb is not kb: self.start(kb, grid)
+            changes = self._changes(grid)
+            # every worker gets the changes, even one with no cells to ask about
+            for n, conn in enumerate(self._connections):
+                conn.send((changes, cells[n::self.workers], first))
+            decisions, undecided = [], []
+            for conn in self._connections:
+                found, unanswered, derived = conn.recv()
+                merge_derived(kb, derived)
+                decisions.extend(found)
+                undecided.extend(unanswered)
+        ms.decisions(kb).undecided.update(undecided)
+        return decisions
+
+    def deduce(self, kb, grid, mode='first'):
+        """deduceSafeCell with the frontier split across the workers. Cells the
+            decision cache has already decided are served from it, and cells it
+            knows cannot be decided yet are not asked about.
+
+        Args:
+            kb (KnowledgeBase): knowledge base for the current board
+            grid (listof list): current board as shown to the player
+            mode (str): 'first' to return a single decisive cell, 'all' to
+                decide every frontier cell
+
+        Returns:
+            ((int, int)|None, bool) in 'first' mode, like deduceSafeCell.
+                listof ((int, int), bool) in 'all' mode, in frontier order.
+        """
+        if mode not in ('first', 'all'):
+            raise ValueError("mode must be 'first' or 'all', not {!r}".format(mode))
+        cache = ms.decisions(kb)
+        kb.infer()
+        if mode == 'first':
+            move = cache.next_move(grid)
+            if move is not None: return move
+        frontier = sorted(ms.findFrontier(grid))
+        order = {cell: n for n, cell in enumerate(frontier)}
+        decisions = [(cell, False) for cell in cache.safe if cell in order]
+        decisions += [(cell, True) for cell in cache.bombs if cell in order]
+        if kb.mode != 'seminaive':
+            decided = {cell for cell, isBomb in decisions}
+            cells = [cell for cell in frontier
+                     if cell not in decided and cell not in cache.undecided]
+            if cells: decisions += self.ask(kb, cells, grid, mode == 'first')
+        decisions.sort(key=lambda d: order[d[0]])
+        if mode == 'first':
+            return decisions[0] if decisions else (None, False)
+        return decisions
+
+# Deducer used by deduce_parallel, kept between calls so its workers are reused
+_deducer = None
+
+def deduce_parallel(kb, grid, workers=None, mode='first'):
+    """ParallelDeducer.deduce with a deducer that is kept between calls, so a
+        game started with the same number of workers reuses them every turn
+
+    Args:
+        kb (KnowledgeBase): knowledge base for the current board
+        grid (listof list): current board as shown to the player
+        workers (int|None): number of processes, default os.cpu_count()
+        mode (str): 'first' or 'all', see ParallelDeducer.deduce
+    """
+    global _deducer
+    workers = workers or os.cpu_count() or 1
+    if _deducer is None or _deducer.workers != workers:
+        shutdown()
+        _deducer = ParallelDeducer(workers)
+    return _deducer.deduce(kb, grid, mode)
+
+def shutdown():
+    """Stop the workers of deduce_parallel"""
+    global _deducer
+    if _deducer is not None: _deducer.close()
+    _deducer = None
@@ -1,5 +1,149 @@
+import re
+import sys
+import time
+
 from logical_classes import *
 
+_TOKEN = re.compile(r'\(|\)|->|(?:[^\s()-]|-(?!>))+')
+
+class ParseError(ValueError):
+    """Raised when a fact or rule cannot be parsed
+
+    Attributes:
+        message (str): what was wrong
+        line (int): line number the problem was found on, starting at 1
+        column (int): column the problem was found at, starting at 1
+    """
+    def __init__(self, message, line, column):
+        """Constructor for ParseError
+
+        Args:
+            message (str): what was wrong
+            line (int): line number the problem was found on
+            column (int): column the problem was found at
+        """
+        super(ParseError, self).__init__(message, line, column)
+        self.message = message
+        self.line = line
+        self.column = column
+
+    def __str__(self):
+        """Define external representation when printed
+        """
+        return "line {}, column {}: {}".format(self.line, self.column, self.message)
+
+def tokenize(lines):
+    """Split lines into tokens in a single pass. Blank lines and lines starting
+        with '#' are skipped. A line starting with "fact:" or "rule:" begins a
+        new statement, any other line continues the previous one.
+
+    Args:
+        lines (iterable of str): lines of text, e.g. an open file
+
+    Yields:
+        (str, str, int, int): token text, one of 'fact', 'rule', '(', ')', '->'
+            or a symbol, whether it is a 'header', and its line and column
+    """
+    for lineno, line in enumerate(lines, 1):
+        stripped = line.lstrip()
+        if not stripped or stripped[0] == '#': continue
+        start = len(line) - len(stripped)
+        if stripped[:5] in ("fact:", "rule:"):
+            yield (stripped[:4], 'header', lineno, start + 1)
+            start += 5
+        for m in _TOKEN.finditer(line, start):
+            yield (m.group(), 'token', lineno, m.start() + 1)
+
+class _Tokens(object):
+    # Iterator over tokenize that remembers the last token it produced, so an
+    # error at the end of input can point just past it
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.last = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.last = next(self.tokens)
+        return self.last
+
+    def end(self):
+        # line and column just past the last token, the header's colon included
+        text, kind, line, column = self.last
+        return line, column + len(text) + (kind == 'header')
+
+def iter_parse(lines):
+    """Parse facts and rules from any iterable of lines in a single pass,
+        without holding more than the statement being parsed in memory
+
+    Args:
+        lines (iterable of str): lines of text, e.g. an open file. Facts have the
+            form "fact: (isa cube block)" and rules the form
+            "rule: ((inst ?x ?y) (isa ?y ?z)) -> (inst ?x ?z)", either may span
+            several lines.
+
+    Yields:
+        Fact|Rule: each parsed fact or rule, in file order
+
+    Raises:
+        ParseError: with the line and column of the first malformed token, or
+            of the end of input if a statement is left unterminated
+    """
+    tokens = _Tokens(tokenize(lines))
+    tok = next(tokens, None)
+    while tok is not None:
+        if tok[1] != 'header':
+            raise ParseError("expected 'fact:' or 'rule:', found " + repr(tok[0]), tok[2], tok[3])
+        header = tok
+        tok = next(tokens, None)
+        if header[0] == 'fact':
+            statement, tok = _parse_statement(tokens, tok)
+            parsed = Fact(statement)
+        else:
+            lhs, tok = _parse_lhs(tokens, tok)
+            tok = _expect(tokens, tok, '->')
+            rhs, tok = _parse_statement(tokens, tok)
+            parsed = Rule([lhs, rhs])
+        if tok is not None and tok[1] != 'header':
+            raise ParseError("unexpected " + repr(tok[0]) + " after " + header[0], tok[2], tok[3])
+        yield parsed
+
+def _expect(tokens, tok, text):
+    if tok is None:
+        raise ParseError("expected " + repr(text) + " before end of input", *tokens.end())
+    if tok[0] != text or tok[1] == 'header':
+        raise ParseError("expected " + repr(text) + ", found " + repr(tok[0]), tok[2], tok[3])
+    return next(tokens, None)
+
+def _parse_symbols(tokens, tok):
+    symbols = []
+    while tok is not None and tok[1] == 'token' and tok[0] not in ('(', ')', '->'):
+        symbols.append(tok[0])
+        tok = next(tokens, None)
+    if not symbols:
+        if tok is None:
+            raise ParseError("expected a predicate before end of input", *tokens.end())
+        raise ParseError("expected a predicate, found " + repr(tok[0]), tok[2], tok[3])
+    return symbols, tok
+
+def _parse_statement(tokens, tok):
+    tok = _expect(tokens, tok, '(')
+    symbols, tok = _parse_symbols(tokens, tok)
+    return symbols, _expect(tokens, tok, ')')
+
+def _parse_lhs(tokens, tok):
+    tok = _expect(tokens, tok, '(')
+    # a single premise may be written without the enclosing parentheses
+    if tok is not None and tok[0] != '(':
+        symbols, tok = _parse_symbols(tokens, tok)
+        return [symbols], _expect(tokens, tok, ')')
+    lhs = []
+    while tok is not None and tok[0] == '(' and tok[1] == 'token':
+        statement, tok = _parse_statement(tokens, tok)
+        lhs.append(statement)
+    return lhs, _expect(tokens, tok, ')')
+
 # read_tokenize takes the name of a file, reads it in and tokenizes the
 # statements and rules in that file.
 def read_tokenize(file):
@@ -15,24 +159,12 @@ def read_tokenize(file):
 
     Returns:
         A list of Facts and Rules.
+
+    Raises:
+        ParseError: if the file contains a malformed fact or rule
     """
-    file = open(file, "r")
-    elements = []
-    current = ""
-    for line in file:
-        if line[0:5] in ("fact:", "rule:"):
-            elements.append(current)
-            current = line.rstrip()
-        else:
-            current = current + " " + line.rstrip().strip()
-    elements.append(current)
-    output = []
-    for e in elements:
-        parsed = parse_input(e)
-        if isinstance(parsed, Fact) or isinstance(parsed, Rule):
-            output.append(parsed)
-    file.close()
-    return output
+    with open(file, "r") as lines:
+        return list(iter_parse(lines))
 
 
 def parse_input(e):
@@ -42,27 +174,19 @@ def parse_input(e):
         e (string): Input string to parse
 
     Returns:
-        (number, string | listof string): label, then parsed input
+        Fact|Rule|str|None: the parsed fact or rule, the text of a comment, or
+            None for blank input
+
+    Raises:
+        ParseError: if the input is not a well-formed fact, rule or comment
     """
     if len(e) == 0:
-        #return (BLANK, None)
         return None
     elif e[0] == '#':
-        #return (COMMENT, e)
         return e[1:]
-    elif e[0:5] == "fact:":
-        e = e[5:].replace(")", "").replace("(", "").rstrip().strip().split()
-        #return (FACT, e)
-        return Fact(e)
-    elif e[0:5] == "rule:":
-        e = e[5:].split("->")
-        rhs = e[1].replace(")", "").replace("(", "").rstrip().strip().split()
-        lhs = e[0].rstrip(") ").strip("( ").replace("(", "").split(")")
-        lhs = map(lambda x: x.rstrip().strip().split(), lhs)
-        #return (RULE, [lhs, rhs])
-        return Rule([lhs, rhs])
-    else:
-        print("PARSE ERROR: input header", e[0:5], "not recognized.")
+    for parsed in iter_parse((e,)):
+        return parsed
+    return None
 
 def get_new_fact_or_rule():
     """Creates a new fact or rule. (instead of args, we use command line input
@@ -90,3 +214,14 @@ def get_new_statements():
     e = read_from_input("Please type in a statement of the form " +
             "\"pred x1 x2 ...\":\n")
     return e.split()
+
+
+if __name__ == '__main__':
+    # Report parse throughput for a rules/facts file, e.g. python read.py minesweeper_kb.txt
+    path = sys.argv[1] if len(sys.argv) > 1 else 'minesweeper_kb.txt'
+    start = time.perf_counter()
+    with open(path, "r") as lines:
+        count = sum(1 for _ in iter_parse(lines))
+    elapsed = time.perf_counter() - start
+    print("{} statements in {:.3f}s ({:.0f} statements/second)".format(
+            count, elapsed, count / elapsed if elapsed else float('inf')))
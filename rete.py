@@ -0,0 +1,280 @@
+from util import is_var
+from logical_classes import Statement
+
+def _pattern_key(statement):
+    """Canonical form of an LHS pattern so identical patterns share one alpha
+        memory, e.g. (nextTo ?t ?c) and (nextTo ?a ?b) both become
+        ('nextTo', 0, 1)
+    """
+    numbering = {}
+    key = [statement.predicate]
+    for term in statement.terms:
+        if is_var(term):
+            key.append(numbering.setdefault(term, len(numbering)))
+        else:
+            key.append(term)
+    return tuple(key)
+
+class AlphaMemory(object):
+    """Facts that pass the constant and repeated-variable tests of one LHS pattern
+
+    Attributes:
+        pattern (Statement): pattern facts are tested against
+        tests (listof (int, Term|int)): position -> constant the fact must have there,
+            or position of an earlier occurrence of the same variable
+        items (dictof Fact): facts in this memory keyed by statement
+        indexes (dictof dict): join positions -> join key -> facts, one index per
+            distinct set of positions the successor join nodes look up by
+        successors (listof JoinNode): nodes right-activated when a fact is added,
+            deepest first so a fact matching two premises of a rule is only joined once
+    """
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.tests = []
+        first_seen = {}
+        for pos, term in enumerate(pattern.terms):
+            if not is_var(term):
+                self.tests.append((pos, term))
+            elif term in first_seen:
+                self.tests.append((pos, first_seen[term]))
+            else:
+                first_seen[term] = pos
+        self.items = {}
+        self.indexes = {}
+        self.successors = []
+
+    def test(self, statement):
+        terms = statement.terms
+        for pos, expected in self.tests:
+            if expected.__class__ is int:
+                if terms[pos] is not terms[expected]: return False
+            elif terms[pos] is not expected:
+                return False
+        return True
+
+    def add_index(self, positions):
+        if positions in self.indexes: return
+        index = self.indexes[positions] = {}
+        for fact in self.items.values():
+            key = tuple(fact.statement.terms[p] for p in positions)
+            index.setdefault(key, []).append(fact)
+
+    def add(self, fact):
+        self.items[fact.statement] = fact
+        terms = fact.statement.terms
+        for positions, index in self.indexes.items():
+            index.setdefault(tuple(terms[p] for p in positions), []).append(fact)
+
+    def remove(self, fact):
+        del self.items[fact.statement]
+        terms = fact.statement.terms
+        for positions, index in self.indexes.items():
+            key = tuple(terms[p] for p in positions)
+            bucket = index[key]
+            bucket.remove(fact)
+            if not bucket: del index[key]
+
+    def lookup(self, positions, key):
+        return self.indexes[positions].get(key, ())
+
+class BetaMemory(object):
+    """Partial matches (tokens) of the first n premises of a rule, indexed by the
+        values the next join node needs
+
+    Attributes:
+        tokens (dictof tuple): key -> tokens, a token is a tuple of the matched facts
+    """
+    def __init__(self):
+        self.tokens = {}
+
+    def add(self, key, token):
+        self.tokens.setdefault(key, []).append(token)
+
+    def remove(self, key, token):
+        bucket = self.tokens.get(key)
+        if bucket is None: return
+        for i, existing in enumerate(bucket):
+            if existing is token:
+                bucket.pop(i)
+                break
+        if not bucket: del self.tokens[key]
+
+    def lookup(self, key):
+        return self.tokens.get(key, ())
+
+class JoinNode(object):
+    """Joins the partial matches of premises 0..level-1 of a rule with the facts
+        matching premise `level`
+
+    Attributes:
+        rule (Rule): rule this node belongs to
+        level (int): index of the premise this node adds
+        alpha (AlphaMemory): memory holding the facts matching the premise
+        right_positions (tupleof int): positions in the premise of variables bound
+            by earlier premises
+        left_locations (tupleof (int, int)): (premise, position) in the token where
+            each of those variables was first bound
+        memory (BetaMemory|None): memory holding the tokens this node produces,
+            None for the last premise whose tokens are complete matches
+        child (JoinNode|None): node for the next premise
+    """
+    def __init__(self, rule, level, alpha, right_positions, left_locations):
+        self.rule = rule
+        self.level = level
+        self.alpha = alpha
+        self.right_positions = right_positions
+        self.left_locations = left_locations
+        self.parent = None
+        self.memory = None
+        self.child = None
+
+    def token_key(self, token, locations):
+        return tuple(token[i].statement.terms[p] for i, p in locations)
+
+class ReteNetwork(object):
+    """Incremental match network compiled from rule LHSs. Alpha memories hold
+        the facts matching each pattern and beta memories hold partial matches,
+        so asserting a fact only does work proportional to the matches it takes
+        part in.
+
+    Attributes:
+        alpha (dictof AlphaMemory): canonical pattern -> alpha memory
+        alpha_by_head (dictof listof AlphaMemory): (predicate, arity) -> memories
+            a fact with that head has to be tested against
+        tokens_by_fact (dictof list): statement of fact -> (node, key, token) entries
+            for every stored token containing that fact
+        rhs_sources (dictof list): rule -> per RHS term either the constant term
+            or the (premise, position) it is copied from
+    """
+    def __init__(self):
+        self.alpha = {}
+        self.alpha_by_head = {}
+        self.tokens_by_fact = {}
+        self.rhs_sources = {}
+
+    def _alpha_memory(self, pattern, facts):
+        key = _pattern_key(pattern)
+        memory = self.alpha.get(key)
+        if memory is None:
+            memory = self.alpha[key] = AlphaMemory(pattern)
+            head = (pattern.predicate, len(pattern.terms))
+            self.alpha_by_head.setdefault(head, []).append(memory)
+            for fact in facts.candidates(pattern):
+                if memory.test(fact.statement): memory.add(fact)
+        return memory
+
+    def add_rule(self, rule, facts):
+        """Compile rule into the network and match it against the facts already known
+
+        Args:
+            rule (Rule): rule to add
+            facts (FactStore): facts currently in the KB
+
+        Returns:
+            listof (Rule, tuple): complete matches, each a rule and the facts matched
+                against its LHS
+        """
+        bound = {}
+        parent = None
+        first = None
+        for level, stmt in enumerate(rule.lhs):
+            alpha = self._alpha_memory(stmt, facts)
+            right_positions = []
+            left_locations = []
+            for pos, term in enumerate(stmt.terms):
+                if is_var(term) and term in bound:
+                    right_positions.append(pos)
+                    left_locations.append(bound[term])
+            for pos, term in enumerate(stmt.terms):
+                if is_var(term) and term not in bound: bound[term] = (level, pos)
+            node = JoinNode(rule, level, alpha, tuple(right_positions), tuple(left_locations))
+            alpha.add_index(node.right_positions)
+            alpha.successors.append(node)
+            alpha.successors.sort(key=lambda n: -n.level)
+            if parent is None:
+                first = node
+            else:
+                parent.memory = BetaMemory()
+                parent.child = node
+                node.parent = parent
+            parent = node
+        self.rhs_sources[rule] = [bound.get(t, t) if is_var(t) else t for t in rule.rhs.terms]
+
+        matches = []
+        if first is not None:
+            for fact in list(first.alpha.items.values()):
+                self._emit(first, (fact,), matches)
+        return matches
+
+    def add_fact(self, fact):
+        """Propagate a newly asserted fact through the network
+
+        Args:
+            fact (Fact): fact to add
+
+        Returns:
+            listof (Rule, tuple): new complete matches
+        """
+        matches = []
+        stmt = fact.statement
+        for alpha in self.alpha_by_head.get((stmt.predicate, len(stmt.terms)), ()):
+            if not alpha.test(stmt): continue
+            alpha.add(fact)
+            for node in alpha.successors:
+                self._right_activate(node, fact, matches)
+        return matches
+
+    def remove_fact(self, fact):
+        """Remove a retracted fact and every partial match containing it
+
+        Args:
+            fact (Fact): fact to remove
+        """
+        stmt = fact.statement
+        for alpha in self.alpha_by_head.get((stmt.predicate, len(stmt.terms)), ()):
+            if stmt in alpha.items: alpha.remove(fact)
+        for node, key, token in self.tokens_by_fact.pop(stmt, ()):
+            node.memory.remove(key, token)
+            # drop the token from the entries of the other facts in it too
+            for other in token:
+                entries = self.tokens_by_fact.get(other.statement)
+                if not entries: continue
+                entries[:] = [entry for entry in entries if entry[2] is not token]
+                if not entries: del self.tokens_by_fact[other.statement]
+
+    def conclusion(self, rule, token):
+        """Instantiate the RHS of rule for a complete match
+
+        Args:
+            rule (Rule): matched rule
+            token (tuple): facts matched against the LHS of rule
+
+        Returns:
+            Statement: the instantiated RHS
+        """
+        terms = [source if source.__class__ is not tuple
+                 else token[source[0]].statement.terms[source[1]]
+                 for source in self.rhs_sources[rule]]
+        return Statement([rule.rhs.predicate] + terms)
+
+    def _right_activate(self, node, fact, matches):
+        if node.parent is None:
+            self._emit(node, (fact,), matches)
+            return
+        terms = fact.statement.terms
+        key = tuple(terms[p] for p in node.right_positions)
+        for token in list(node.parent.memory.lookup(key)):
+            self._emit(node, token + (fact,), matches)
+
+    def _emit(self, node, token, matches):
+        child = node.child
+        if child is None:
+            matches.append((node.rule, token))
+            return
+        key = node.token_key(token, child.left_locations)
+        node.memory.add(key, token)
+        entry = (node, key, token)
+        for fact in token:
+            self.tokens_by_fact.setdefault(fact.statement, []).append(entry)
+        for fact in list(child.alpha.lookup(child.right_positions, key)):
+            self._emit(child, token + (fact,), matches)
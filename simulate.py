@@ -0,0 +1,181 @@
+"""Headless, seeded games of Minesweeper played by the KB, for measuring solver
+speed and win rate without a human.
+
+    python simulate.py --games 20 --size 8 --mines 10 --seed 1 --format csv
+
+Running the same seeds with --mode seminaive and --mode backward compares a KB
+saturated after every update with one that backward chains every ask.
+"""
+import argparse
+import csv
+import functools
+import json
+import random
+import sys
+import time
+
+import csp_solver
+from knowledgebase import MODES
+import minesweeper as ms
+import parallel
+
+FIELDS = ['seed', 'size', 'mines', 'won', 'moves', 'deduced', 'guesses',
+          'wrong_flags', 'init_kb_s', 'updateKB_s', 'deduce_s', 'facts', 'rules', 'mode']
+
+def random_fallback(grid, rng):
+    """Pick a uniformly random unrevealed, unflagged cell
+
+    Args:
+        grid (listof list): current board as shown to the player
+        rng (random.Random): source of randomness for the game
+
+    Returns:
+        (int, int)|None: row and column of the cell to reveal, None if every
+            cell is revealed or flagged
+    """
+    cells = [(i, j) for i, row in enumerate(grid) for j, ele in enumerate(row) if ele == ' ']
+    return rng.choice(cells) if cells else None
+
+def first_fallback(grid, rng):
+    """Pick the first unrevealed, unflagged cell in row-major order
+    """
+    for i, row in enumerate(grid):
+        for j, ele in enumerate(row):
+            if ele == ' ': return (i, j)
+
+FALLBACKS = {'random': random_fallback, 'first': first_fallback}
+
+ENGINES = {'kb': ms.deduceSafeCell, 'csp': csp_solver.deduceSafeCell}
+
+def play_headless(gridsize, numberofmines, seed, fallback=random_fallback,
+                  snapshot_dir=ms.SNAPSHOT_DIR, deduce=ms.deduceSafeCell, mode='rete'):
+    """Play one game end to end, taking the KB's suggestion every turn and
+        asking fallback for a cell to reveal when the KB has none
+
+    Args:
+        gridsize (int): width and height of the board
+        numberofmines (int): number of mines on the board
+        seed (int): seed for the mine layout and the fallback's choices
+        fallback (function): (grid, rng) -> (row, col) of a cell to reveal, or None
+        snapshot_dir (str|None): passed on to init_kb
+        deduce (function): (kb, grid) -> (cell, isBomb), deduceSafeCell or a
+            replacement for it
+        mode (str): evaluation mode of the KB, see KnowledgeBase.mode
+
+    Returns:
+        dict: one record with the FIELDS of the game
+    """
+    rng = random.Random(seed)
+    timings = {'init_kb_s': 0.0, 'updateKB_s': 0.0, 'deduce_s': 0.0}
+
+    start = time.perf_counter()
+    kb = ms.init_kb(gridsize, snapshot_dir, mode)
+    timings['init_kb_s'] += time.perf_counter() - start
+
+    currgrid = [[' ' for i in range(gridsize)] for i in range(gridsize)]
+    first = fallback(currgrid, rng)
+    grid, mines = ms.setupgrid(gridsize, first, numberofmines, rng)
+    mines = set(mines)
+    changed = ms.showcells(grid, currgrid, *first)
+    moves, deduced, guesses, wrong_flags = 1, 0, 1, 0
+    hidden = sum(row.count(' ') for row in currgrid)
+    won = hidden == numberofmines
+
+    while not won:
+        start = time.perf_counter()
+        ms.updateKB(currgrid, kb, changed)
+        timings['updateKB_s'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        cell, isBomb = deduce(kb, currgrid)
+        timings['deduce_s'] += time.perf_counter() - start
+
+        if cell:
+            deduced += 1
+        else:
+            cell, isBomb = fallback(currgrid, rng), False
+            # Only wrong flags can leave nothing to reveal before the game is won
+            if cell is None: break
+            guesses += 1
+        moves += 1
+        rowno, colno = cell
+        if isBomb:
+            currgrid[rowno][colno] = 'F'
+            changed = {cell}
+            if cell not in mines: wrong_flags += 1
+        elif cell in mines:
+            break
+        else:
+            changed = ms.showcells(grid, currgrid, rowno, colno)
+        won = sum(row.count(' ') + row.count('F') for row in currgrid) == numberofmines \
+            and not wrong_flags
+
+    record = {'seed': seed, 'size': gridsize, 'mines': numberofmines, 'won': won,
+              'moves': moves, 'deduced': deduced, 'guesses': guesses,
+              'wrong_flags': wrong_flags, 'facts': len(kb.facts), 'rules': len(kb.rules),
+              'mode': mode}
+    record.update({k: round(v, 6) for k, v in timings.items()})
+    return record
+
+def simulate(games, gridsize, numberofmines, seed=0, fallback=random_fallback,
+             snapshot_dir=ms.SNAPSHOT_DIR, deduce=ms.deduceSafeCell, mode='rete'):
+    """Play games headless games with seeds seed, seed+1, ...
+
+    Returns:
+        listof dict: one record per game, see play_headless
+    """
+    return [play_headless(gridsize, numberofmines, seed + n, fallback, snapshot_dir,
+                          deduce, mode)
+            for n in range(games)]
+
+def write_records(records, out, fmt):
+    """Write game records to out as 'json' or 'csv'
+    """
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        json.dump(records, out, indent=2)
+        out.write('\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--size', type=int, default=10)
+    parser.add_argument('--mines', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fallback', choices=sorted(FALLBACKS), default='random')
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--output', help='file to write records to, default stdout')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='build every KB from scratch instead of loading a snapshot')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='kb',
+                        help='rule KB or constraint solver to deduce moves with')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='ask about the frontier in this many processes, 0 to ask serially')
+    parser.add_argument('--mode', choices=MODES, default='rete',
+                        help='forward chain with Rete, saturate semi-naively or only '
+                             'backward chain, see KnowledgeBase.mode')
+    args = parser.parse_args(argv)
+
+    ms.verbose = 0
+    deduce = ENGINES[args.engine]
+    if args.workers and args.engine == 'kb':
+        deduce = functools.partial(parallel.deduce_parallel, workers=args.workers)
+    try:
+        records = simulate(args.games, args.size, args.mines, args.seed,
+                           FALLBACKS[args.fallback],
+                           None if args.no_snapshot else ms.SNAPSHOT_DIR, deduce, args.mode)
+    finally:
+        parallel.shutdown()
+    if args.output:
+        with open(args.output, 'w', newline='') as out:
+            write_records(records, out, args.format)
+    else:
+        write_records(records, sys.stdout, args.format)
+    wins = sum(r['won'] for r in records)
+    print('{}/{} games won'.format(wins, len(records)), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
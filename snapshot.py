@@ -0,0 +1,90 @@
+import hashlib
+import io
+import os
+import pickle
+
+from logical_classes import Variable, Constant
+
+MAGIC = b'KRRKB'
+VERSION = 9
+
+def snapshot_key(rules_file, gridsize, mode='rete'):
+    """Build the key a snapshot is stored under, so a snapshot is only reused
+        for the same rules file contents, grid size, KB mode and format version
+
+    Args:
+        rules_file (str): path of the rules file the KB was built from
+        gridsize (int): size of the board the KB was initialized for
+        mode (str): evaluation mode of the KB, see KnowledgeBase.mode
+
+    Returns:
+        str: hex digest identifying the snapshot
+    """
+    digest = hashlib.sha256()
+    with open(rules_file, 'rb') as file:
+        digest.update(file.read())
+    digest.update('{}:{}:{}'.format(VERSION, gridsize, mode).encode())
+    return digest.hexdigest()
+
+def snapshot_path(directory, gridsize, key):
+    """Path of the snapshot file for key inside directory
+    """
+    return os.path.join(directory, 'kb-{}-{}.snap'.format(gridsize, key[:16]))
+
+def save(kb, path, key):
+    """Write kb to path as a versioned binary snapshot. The file holds a header
+        (magic, format version, key) followed by two pickles written with one
+        pickler: the interned symbol table, then the KB with its fact/rule
+        indexes and Rete network. Sharing the pickler stores each symbol string
+        once, and the statements in the KB refer back to it. load re-interns
+        the symbols in their saved order before unpickling the KB, so
+        variables get their slots in the same order as when the KB was built.
+
+    Args:
+        kb (KnowledgeBase): knowledge base to save
+        path (str): file to write, its directory is created if needed
+        key (str): key from snapshot_key
+    """
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    symbols = (list(Variable._interned), list(Constant._interned))
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dump(symbols)
+    pickler.dump(kb)
+    payload = buffer.getbuffer()
+    header = MAGIC + bytes([VERSION]) + key.encode('ascii')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(len(header).to_bytes(2, 'little') + header + payload)
+    os.replace(tmp, path)
+
+def load(path, key):
+    """Load a snapshot written by save with one bulk read
+
+    Args:
+        path (str): file to read
+        key (str): key the snapshot must have been saved under
+
+    Returns:
+        KnowledgeBase|None: the loaded knowledge base, None if the file does not
+            exist, was written for another key or format version, or is
+            truncated or corrupt
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return None
+    size = int.from_bytes(data[:2], 'little')
+    header = data[2:2 + size]
+    if header != MAGIC + bytes([VERSION]) + key.encode('ascii'):
+        return None
+    unpickler = pickle.Unpickler(io.BytesIO(memoryview(data)[2 + size:]))
+    try:
+        variables, constants = unpickler.load()
+        for name in variables: Variable(name)
+        for name in constants: Constant(name)
+        return unpickler.load()
+    except (pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+        return None
@@ -0,0 +1,317 @@
+import itertools
+
+from util import is_var
+
+def _discard(index, index_key, key):
+    """Remove key from the bucket index[index_key], dropping the bucket once empty"""
+    bucket = index.get(index_key)
+    if bucket is None or key not in bucket: return
+    del bucket[key]
+    if not bucket: del index[index_key]
+
+class FactStore(object):
+    """Fact container indexed by predicate and by each argument position. Keeps
+        the add/lookup/iterate semantics of the plain list it replaces, but
+        membership checks are O(1) and pattern lookups, e.g. (nextTo c34 ?c),
+        only touch the facts that could match.
+
+    Attributes:
+        facts (dictof Fact): every stored fact keyed by its statement, in insertion order
+        by_pred (dictof dict): (predicate, arity) -> facts with that predicate
+        by_arg (dictof dict): (predicate, arity, position, constant) -> facts
+            with that constant at that position
+        nonground (dictof dict): (predicate, arity) -> facts containing variables,
+            these are candidates for every pattern with that predicate
+    """
+    def __init__(self, facts=[]):
+        """Constructor for FactStore
+
+        Args:
+            facts (listof Fact): facts to start the store with
+        """
+        super(FactStore, self).__init__()
+        self.facts = {}
+        self.by_pred = {}
+        self.by_arg = {}
+        self.nonground = {}
+        for fact in facts:
+            self.append(fact)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'FactStore({!r})'.format(list(self.facts.values()))
+
+    def __len__(self):
+        """Define behavior of len, the number of stored facts
+        """
+        return len(self.facts)
+
+    def __iter__(self):
+        """Iterate over stored facts in insertion order
+        """
+        return iter(list(self.facts.values()))
+
+    def __contains__(self, fact):
+        """Define behavior of `in` for a Fact or Statement
+        """
+        return getattr(fact, 'statement', fact) in self.facts
+
+    def get(self, fact):
+        """Get the stored fact with the same statement as fact
+
+        Args:
+            fact (Fact|Statement): fact or statement to look up
+
+        Returns:
+            Fact|None: the stored fact, None if there is none
+        """
+        return self.facts.get(getattr(fact, 'statement', fact))
+
+    def append(self, fact):
+        """Add a fact to the store and its indexes. Facts already in the store
+            are ignored.
+
+        Args:
+            fact (Fact): fact to add
+        """
+        stmt = key = fact.statement
+        if key in self.facts: return
+        self.facts[key] = fact
+        head = (stmt.predicate, len(stmt.terms))
+        self.by_pred.setdefault(head, {})[key] = fact
+        ground = True
+        for pos, term in enumerate(stmt.terms):
+            if is_var(term):
+                ground = False
+                continue
+            self.by_arg.setdefault(head + (pos, term), {})[key] = fact
+        if not ground:
+            self.nonground.setdefault(head, {})[key] = fact
+
+    def remove(self, fact):
+        """Remove a fact from the store and its indexes
+
+        Args:
+            fact (Fact|Statement): fact to remove
+
+        Raises:
+            ValueError: if the fact is not in the store
+        """
+        stmt = key = getattr(fact, 'statement', fact)
+        if key not in self.facts:
+            raise ValueError('{!s} not in FactStore'.format(stmt))
+        del self.facts[key]
+        head = (stmt.predicate, len(stmt.terms))
+        _discard(self.by_pred, head, key)
+        _discard(self.nonground, head, key)
+        for pos, term in enumerate(stmt.terms):
+            if not is_var(term):
+                _discard(self.by_arg, head + (pos, term), key)
+
+    def estimate(self, statement):
+        """Estimate how many facts match statement from the index sizes: the
+            number of facts with its predicate, narrowed to the smallest bucket
+            among its constant arguments
+
+        Args:
+            statement (Statement): pattern to estimate, e.g. (nextTo c34 ?c)
+
+        Returns:
+            int: upper bound on the number of matching ground facts
+        """
+        head = (statement.predicate, len(statement.terms))
+        best = len(self.by_pred.get(head, ()))
+        for pos, term in enumerate(statement.terms):
+            if best == 0: break
+            if is_var(term): continue
+            best = min(best, len(self.by_arg.get(head + (pos, term), ())))
+        return best + len(self.nonground.get(head, ()))
+
+    def candidates(self, statement):
+        """Get the facts that could match statement, using the most selective
+            index available for its constant arguments
+
+        Args:
+            statement (Statement): pattern to look up, e.g. (nextTo c34 ?c)
+
+        Returns:
+            listof Fact: facts with the same predicate and arity that agree with
+                the constant arguments of the pattern (plus any facts that
+                contain variables)
+        """
+        head = (statement.predicate, len(statement.terms))
+        best = self.by_pred.get(head)
+        if not best: return []
+        for pos, term in enumerate(statement.terms):
+            if is_var(term): continue
+            bucket = self.by_arg.get(head + (pos, term))
+            if not bucket:
+                best = None
+                break
+            if len(bucket) < len(best): best = bucket
+        nonground = self.nonground.get(head)
+        if best is None:
+            return list(nonground.values()) if nonground else []
+        if nonground and best is not self.by_pred[head]:
+            return list(best.values()) + [f for k, f in nonground.items() if k not in best]
+        return list(best.values())
+
+class RuleStore(object):
+    """Rule container indexed by the predicate and arity of the RHS, and by the
+        constant arguments of the RHS, so goal-directed lookups only consider
+        rules that can conclude the goal, e.g. for (safe c45) the rules
+        concluding (safe ?c) or (safe c45) but not (safe c12) or (bomb ?c).
+
+    Attributes:
+        rules (dictof Rule): every stored rule, in insertion order
+        by_head (dictof dict): (predicate, arity) -> rules with that RHS
+        by_head_arg (dictof dict): (predicate, arity, position, constant) -> rules
+            with that constant at that position of the RHS
+        open_head (dictof dict): (predicate, arity, position) -> rules with a
+            variable at that position of the RHS
+        by_predicate (dictof dict): predicate -> rules with that RHS predicate, any arity
+        by_premise (dictof dict): predicate -> rules with an LHS statement with
+            that predicate
+    """
+    def __init__(self, rules=[]):
+        """Constructor for RuleStore
+
+        Args:
+            rules (listof Rule): rules to start the store with
+        """
+        super(RuleStore, self).__init__()
+        self.rules = {}
+        self.by_head = {}
+        self.by_head_arg = {}
+        self.open_head = {}
+        self.by_predicate = {}
+        self.by_premise = {}
+        for rule in rules:
+            self.append(rule)
+
+    def __repr__(self):
+        """Define internal string representation
+        """
+        return 'RuleStore({!r})'.format(list(self.rules))
+
+    def __len__(self):
+        """Define behavior of len, the number of stored rules
+        """
+        return len(self.rules)
+
+    def __iter__(self):
+        """Iterate over stored rules in insertion order
+        """
+        return iter(list(self.rules))
+
+    def __contains__(self, rule):
+        """Define behavior of `in` for a Rule
+        """
+        return rule in self.rules
+
+    def get(self, rule):
+        """Get the stored rule equal to rule
+
+        Args:
+            rule (Rule): rule to look up
+
+        Returns:
+            Rule|None: the stored rule, None if there is none
+        """
+        return self.rules.get(rule)
+
+    def append(self, rule):
+        """Add a rule to the store and its indexes. Rules already in the store
+            are ignored.
+
+        Args:
+            rule (Rule): rule to add
+        """
+        if rule in self.rules: return
+        self.rules[rule] = rule
+        rhs = rule.rhs
+        head = (rhs.predicate, len(rhs.terms))
+        self.by_head.setdefault(head, {})[rule] = rule
+        self.by_predicate.setdefault(rhs.predicate, {})[rule] = rule
+        for stmt in rule.lhs:
+            self.by_premise.setdefault(stmt.predicate, {})[rule] = rule
+        for pos, term in enumerate(rhs.terms):
+            if is_var(term):
+                self.open_head.setdefault(head + (pos,), {})[rule] = rule
+            else:
+                self.by_head_arg.setdefault(head + (pos, term), {})[rule] = rule
+
+    def remove(self, rule):
+        """Remove a rule from the store and its indexes
+
+        Args:
+            rule (Rule): rule to remove
+
+        Raises:
+            ValueError: if the rule is not in the store
+        """
+        if rule not in self.rules:
+            raise ValueError('rule not in RuleStore')
+        del self.rules[rule]
+        rhs = rule.rhs
+        head = (rhs.predicate, len(rhs.terms))
+        _discard(self.by_head, head, rule)
+        _discard(self.by_predicate, rhs.predicate, rule)
+        for stmt in rule.lhs:
+            _discard(self.by_premise, stmt.predicate, rule)
+        for pos, term in enumerate(rhs.terms):
+            if is_var(term):
+                _discard(self.open_head, head + (pos,), rule)
+            else:
+                _discard(self.by_head_arg, head + (pos, term), rule)
+
+    def concluding(self, predicate):
+        """Get the rules whose RHS has predicate, whatever its arity
+
+        Args:
+            predicate (str): RHS predicate to look up
+
+        Returns:
+            listof Rule
+        """
+        return list(self.by_predicate.get(predicate, ()))
+
+    def using(self, predicate):
+        """Get the rules with an LHS statement with predicate, the rules a new
+            fact with predicate can take part in a match of
+
+        Args:
+            predicate (str): LHS predicate to look up
+
+        Returns:
+            listof Rule
+        """
+        return list(self.by_premise.get(predicate, ()))
+
+    def candidates(self, statement):
+        """Get the rules whose RHS could match statement, narrowed by the
+            statement's constant arguments
+
+        Args:
+            statement (Statement): goal to look up, e.g. (safe c45)
+
+        Returns:
+            listof Rule: rules with the same RHS predicate and arity whose RHS has
+                either a variable or the same constant at every position where
+                statement has a constant
+        """
+        head = (statement.predicate, len(statement.terms))
+        rules = self.by_head.get(head)
+        if not rules: return []
+        bound = [(pos, term) for pos, term in enumerate(statement.terms) if not is_var(term)]
+        best = None
+        for pos, term in bound:
+            exact = self.by_head_arg.get(head + (pos, term), {})
+            open_ = self.open_head.get(head + (pos,), {})
+            if best is None or len(exact) + len(open_) < len(best[0]) + len(best[1]):
+                best = (exact, open_)
+        if best is None: return list(rules)
+        return [rule for rule in itertools.chain(*best)
+                if all(is_var(rule.rhs.terms[pos]) or rule.rhs.terms[pos] is term
+                        for pos, term in bound)]
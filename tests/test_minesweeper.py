@@ -0,0 +1,26 @@
+import pytest
+
+import minesweeper as ms
+
+board = pytest.importorskip('board')
+
+def test_deduce_safe_cell_on_board_serves_cached_decision():
+    ms.verbose = 0
+    kb = ms.init_kb(4, None)
+    grid = board.Board.hidden(4)
+    ms.updateKB(grid, kb)
+    ms.decisions(kb)
+    kb.assert_fact('safe', ms.cellid(2, 1))
+    assert ms.deduceSafeCell(kb, grid) == ((2, 1), False)
+
+def test_next_move_skips_revealed_cells_on_non_square_grids():
+    kb = ms.init_kb(4, None)
+    cache = ms.decisions(kb)
+    cache.safe.clear()
+    cache.bombs.clear()
+    cache.safe.update({(0, 0): None, (1, 4): None})
+    grid = [['1', ' ', ' ', ' ', ' '],
+            [' ', ' ', ' ', ' ', ' ']]
+    assert cache.next_move(grid) == ((1, 4), False)
+    state = board.Board.from_grid(grid)
+    assert cache.next_move(state) == ((1, 4), False)
@@ -0,0 +1,20 @@
+import pytest
+
+import read
+
+def _error(text):
+    with pytest.raises(read.ParseError) as info:
+        list(read.iter_parse(text.splitlines(True)))
+    return info.value
+
+def test_unterminated_statement_reports_end_of_input():
+    error = _error("fact: (isa cube block")
+    assert (error.line, error.column) == (1, 22)
+
+def test_unterminated_rule_across_lines_reports_end_of_input():
+    error = _error("fact: (isa a b)\nrule: ((a ?x)\n  (b ?x)) ->\n")
+    assert (error.line, error.column) == (3, 13)
+
+def test_unexpected_token_reports_its_position():
+    error = _error("rule: ((a ?x)) -> (b ?x) extra")
+    assert (error.line, error.column) == (1, 26)
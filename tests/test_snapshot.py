@@ -0,0 +1,26 @@
+import minesweeper as ms
+import snapshot
+
+def _snapshot(tmp_path):
+    key = snapshot.snapshot_key(ms.RULES_FILE, 4)
+    return snapshot.snapshot_path(str(tmp_path), 4, key), key
+
+def test_load_round_trip(tmp_path):
+    kb = ms.init_kb(4, str(tmp_path))
+    path, key = _snapshot(tmp_path)
+    loaded = snapshot.load(path, key)
+    assert loaded is not None
+    assert len(loaded.facts) == len(kb.facts)
+
+def test_truncated_or_corrupt_snapshot_is_a_cache_miss(tmp_path):
+    ms.init_kb(4, str(tmp_path))
+    path, key = _snapshot(tmp_path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    header = 2 + int.from_bytes(data[:2], 'little')
+    for damaged in (data[:len(data) // 2], data[:header + 3],
+                    data[:header] + b'\x00' * (len(data) - header)):
+        with open(path, 'wb') as file:
+            file.write(damaged)
+        assert snapshot.load(path, key) is None
+        assert len(ms.init_kb(4, str(tmp_path)).facts) > 0
@@ -18,46 +18,41 @@ def is_var(var):
 
     return isinstance(var, lc.Variable)
 
-def match(state1, state2, bindings=None, used_terms = []):
+def match(state1, state2, bindings=None, used_terms=frozenset(), instrumentation=None):
     """Match two statements and return the associated bindings or False if there
-        is no binding
+        is no binding. Terms are compared position by position in one loop,
+        using the variable positions each statement classified when it was built.
 
     Args:
         state1 (Statement): statement to match with state2
         state2 (Statement): statement to match with state1
         bindings (Bindings|None): already associated bindings
+        used_terms (frozenset|set of str): values the first term may not be bound
+            to, e.g. the values bound at earlier levels of backward chaining
+        instrumentation (Instrumentation|None): counters of the KB doing the
+            match, see KnowledgeBase.instrument
 
     Returns:
         Bindings|False: either associated bindings or no match found
     """
-    if len(state1.terms) != len(state2.terms) or state1.predicate != state2.predicate:
+    if instrumentation is not None: instrumentation.match_attempts += 1
+    terms1, terms2 = state1.terms, state2.terms
+    if len(terms1) != len(terms2) or state1.predicate != state2.predicate:
         return False
     if not bindings:
         bindings = lc.Bindings()
-    return match_recursive(state1.terms, state2.terms, bindings, used_terms)
-
-def match_recursive(terms1, terms2, bindings, used_terms = []):  # recursive...
-    """Recursive helper for match
-
-    Args:
-        terms1 (listof Term): terms to match with terms2
-        terms2 (listof Term): terms to match with terms1
-        bindings (Bindings): already associated bindings
-
-    Returns:
-        Bindings|False: either associated bindings or no match found
-    """
-    if len(terms1) == 0:
-        return bindings
-    if is_var(terms1[0]) and str(terms2[0]) not in used_terms:
-        if not bindings.test_and_bind(terms1[0], terms2[0]):
-            return False
-    elif is_var(terms2[0]) and str(terms1[0]) not in used_terms:
-        if not bindings.test_and_bind(terms2[0], terms1[0]):
+    vars1, vars2 = state1.var_mask, state2.var_mask
+    for k in range(len(terms1)):
+        term1, term2 = terms1[k], terms2[k]
+        # The exclusion only applies to the first term
+        if vars1[k] and (k or term2.term.element not in used_terms):
+            if not bindings.test_and_bind(term1, term2): return False
+        elif vars2[k] and (k or term1.term.element not in used_terms):
+            if not bindings.test_and_bind(term2, term1): return False
+        elif term1 is not term2:
             return False
-    elif terms1[0] != terms2[0]:
-        return False
-    return match_recursive(terms1[1:], terms2[1:], bindings)
+    if instrumentation is not None: instrumentation.unifications += 1
+    return bindings
 
 def instantiate(statement, bindings):
     """Generate Statement from given statement and bindings. Constructed statement
@@ -67,15 +62,13 @@ def instantiate(statement, bindings):
         statement (Statement): statement to generate new statement from
         bindings (Bindings): bindings to substitute into statement
     """
-    def handle_term(term):
-        if is_var(term):
-            bound_value = bindings.bound_to(term.term)
-            return lc.Term(bound_value) if bound_value else term
-        else:
-            return term
-
-    new_terms = [handle_term(t) for t in statement.terms]
-    return lc.Statement([statement.predicate] + new_terms)
+    new_terms = [statement.predicate]
+    for term, is_variable in zip(statement.terms, statement.var_mask):
+        if is_variable:
+            bound_value = bindings.value_of(term.term)
+            if bound_value is not None: term = bound_value
+        new_terms.append(term)
+    return lc.Statement(new_terms)
 
 def factq(element):
     """Check if element is a fact
@@ -91,12 +84,11 @@ def factq(element):
 
 def rule_has_unknown(rule):
     for stmt in rule.lhs:
-        if is_variable(stmt): return True
+        if True in stmt.var_mask: return True
     return False
 
 def is_variable(stmt):
-    for term in stmt.terms:
-        if isinstance(term.term, lc.Variable): return True
+    return True in stmt.var_mask
 
 def printv(message, level, verbose, data=[]):
     """Prints given message formatted with data if passed in verbose flag is greater than level